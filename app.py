@@ -5,13 +5,19 @@ Analyze up to 50 moves per game
 import streamlit as st
 import chess
 import chess.svg
+import chess.pgn
+import os
 import sys
 from pathlib import Path
 import json
+import io
+import hashlib
+import threading
+import pandas as pd
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.game_analyzer import GameAnalyzer
+from src.game_analyzer import GameAnalyzer, analyses_to_dataframe
 from src.risk_calculator import RiskCalculator
 from src.chess_api import get_famous_games
 
@@ -62,6 +68,7 @@ if 'move_history' not in st.session_state:
     st.session_state.move_history = []
 
 # Helper functions
+@st.cache_data(show_spinner=False)
 def load_my_games():
     """Load embedded games"""
     try:
@@ -91,6 +98,70 @@ def load_my_games():
         }
     ]
 
+def pgn_key(pgn: str) -> str:
+    """Whitespace-insensitive cache key for a PGN string"""
+    return hashlib.blake2b(" ".join(pgn.split()).encode(), digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def uploaded_pgn(file_id: str, _file) -> str:
+    """PGN of the first game in an upload, parsed once per upload (by file_id)"""
+    # Parse only the first game straight off the upload stream
+    _file.seek(0)
+    pgn_stream = io.TextIOWrapper(_file, encoding='utf-8')
+    game = chess.pgn.read_game(pgn_stream)
+    pgn_stream.detach()
+    return str(game) if game is not None else ""
+
+@st.cache_resource(show_spinner=False)
+def engine_lock():
+    """Serializes whole-game analyses on the shared GameAnalyzer across sessions"""
+    return threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def get_analyzer(depth: int = 10) -> GameAnalyzer:
+    """Shared GameAnalyzer (one Stockfish process per depth, plus per-core workers)
+    
+    Its engines are quit at interpreter exit by the engine pool's shutdown hook.
+    """
+    return GameAnalyzer(depth=depth, workers=max(1, (os.cpu_count() or 2) // 2))
+
+@st.cache_resource(show_spinner=False)
+def get_risk_calculator(depth: int = 12) -> RiskCalculator:
+    """Shared RiskCalculator (one Stockfish process per depth, quit at exit by the engine pool)"""
+    return RiskCalculator(depth=depth)
+
+@st.cache_data(show_spinner=False)
+def analyze_position(fen: str, depth: int = 12):
+    """Risk metrics for a position, cached by (FEN, depth)"""
+    # The calculator's analyzer locks its own engine, so this never waits
+    # behind a whole-game analysis
+    return get_risk_calculator(depth).calculate_risk_metrics(chess.Board(fen))
+
+@st.cache_data(persist="disk", show_spinner=False)
+def analyze_pgn(key: str, _pgn: str, max_moves: int = 30, depth: int = 10):
+    """Analyze a PGN, cached on disk by (content key, max_moves, depth)"""
+    with engine_lock():
+        return get_analyzer(depth).analyze_pgn_string(_pgn, max_moves=max_moves)
+
+@st.cache_data(show_spinner=False)
+def moves_table(key: str, _analyses) -> pd.DataFrame:
+    """Display table for an analysis, cached by its analysis key"""
+    emoji = {"excellent": "🟢", "good": "🟡", "inaccuracy": "🟠", "mistake": "🔴", "blunder": "💥"}
+    moves_df = analyses_to_dataframe(_analyses)
+    return pd.DataFrame({
+        "Move": moves_df["move_number"].astype(str) + ". " + moves_df["move"],
+        "Player": moves_df["white_to_move"].map({True: "⚪", False: "⚫"}),
+        "Quality": moves_df["classification"].map(emoji).fillna("⚪") + " " + moves_df["classification"],
+        "Eval (cp)": moves_df["eval_score"],
+        "Risk": moves_df["risk_score"],
+        "Best": moves_df["best_alternative"].where(~moves_df["is_best_move"], "✓"),
+    })
+
+@st.cache_data(show_spinner=False)
+def board_svg(fen: str, size=250) -> str:
+    """Render SVG for a position (cached by FEN across reruns)"""
+    return chess.svg.board(chess.Board(fen), size=size)
+
 def render_board(board: chess.Board, size=500):
     """Render SVG chess board"""
     svg = chess.svg.board(board, size=size)
@@ -157,7 +228,8 @@ with st.sidebar:
     **GitHub:** sohamgugale
     """)
 
-# Sample games
+# Sample games (static and read-only, so share one dict instead of unpickling a copy per rerun)
+@st.cache_resource(show_spinner=False)
 def get_sample_games():
     famous = get_famous_games()
     return {
@@ -233,9 +305,7 @@ if mode == "🎮 Interactive Board":
         if st.button("🔍 Analyze Position", type="primary", use_container_width=True):
             with st.spinner("Analyzing..."):
                 try:
-                    calc = RiskCalculator(depth=12)
-                    metrics = calc.calculate_risk_metrics(st.session_state.board)
-                    calc.close()
+                    metrics = analyze_position(st.session_state.board.fen(), depth=12)
                     
                     st.markdown(f"""
                     <div class="metric-card">
@@ -364,8 +434,11 @@ else:  # Upload PGN
     else:
         file = st.file_uploader("Choose PGN file", type=['pgn', 'txt'])
         if file:
-            pgn_input = file.read().decode('utf-8')
-            st.success("✅ File uploaded!")
+            pgn_input = uploaded_pgn(file.file_id, file)
+            if pgn_input:
+                st.success("✅ File uploaded!")
+            else:
+                st.error("❌ No game found in file")
 
 # Analyze button (for non-interactive modes)
 if mode != "🎮 Interactive Board" and pgn_input:
@@ -375,16 +448,12 @@ if mode != "🎮 Interactive Board" and pgn_input:
             status_text = st.empty()
             
             try:
-                status_text.text("Initializing analyzer...")
-                progress_bar.progress(10)
-                
-                analyzer = GameAnalyzer(depth=10)
-                
                 status_text.text(f"Analyzing moves (max {max_moves})...")
                 progress_bar.progress(30)
                 
-                analyses, report = analyzer.analyze_pgn_string(pgn_input, max_moves=max_moves)
-                analyzer.close()
+                # Hash the PGN once per analysis; the key also identifies the results downstream
+                key = pgn_key(pgn_input)
+                analyses, report = analyze_pgn(key, pgn_input, max_moves=max_moves)
                 
                 progress_bar.progress(100)
                 status_text.empty()
@@ -395,6 +464,7 @@ if mode != "🎮 Interactive Board" and pgn_input:
                     st.balloons()
                     st.session_state['analyses'] = analyses
                     st.session_state['report'] = report
+                    st.session_state['analysis_key'] = f"{key}-{max_moves}"
                 else:
                     st.error("❌ No moves found in PGN")
             
@@ -404,6 +474,53 @@ if mode != "🎮 Interactive Board" and pgn_input:
                 with st.expander("🐛 Debug Info"):
                     st.code(traceback.format_exc())
 
+# Results panels
+@st.fragment
+def move_by_move_panel():
+    """Move table + preview; widget changes rerun only this fragment"""
+    analyses = st.session_state['analyses']
+    
+    df = moves_table(st.session_state['analysis_key'], analyses)
+    st.dataframe(
+        df,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Eval (cp)": st.column_config.NumberColumn(format="%.0f"),
+            "Risk": st.column_config.NumberColumn(format="%.1f"),
+        }
+    )
+    
+    # Board preview for a single selected move
+    preview_idx = st.selectbox(
+        "Select move to preview:",
+        range(len(analyses)),
+        format_func=lambda i: f"{df['Move'][i]} ({df['Player'][i]}) • {analyses[i].classification.upper()}"
+    )
+    a = analyses[preview_idx]
+    pcol1, pcol2 = st.columns([1, 2])
+    
+    with pcol1:
+        # Only build the SVG once the user asks for it
+        if st.checkbox("🖼️ Show board", key="show_preview_board"):
+            try:
+                st.markdown(f'<div style="display: flex; justify-content: center;">{board_svg(a.fen_after, size=250)}</div>', unsafe_allow_html=True)
+            except:
+                st.write("Board preview unavailable")
+    
+    with pcol2:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Eval", f"{a.eval_score:.0f} cp")
+        with col2:
+            st.metric("Risk", f"{a.risk_score:.1f}/100")
+        with col3:
+            if not a.is_best_move:
+                st.markdown(f"**Better Move:**")
+                st.code(a.best_alternative)
+            else:
+                st.success("✓ Best move!")
+
 # Display results
 if 'analyses' in st.session_state and mode != "🎮 Interactive Board":
     analyses = st.session_state['analyses']
@@ -429,36 +546,7 @@ if 'analyses' in st.session_state and mode != "🎮 Interactive Board":
     # Move-by-move analysis with board preview
     st.markdown("### 📝 Move-by-Move Analysis")
     
-    for a in analyses:
-        emoji = {"excellent": "🟢", "good": "🟡", "inaccuracy": "🟠", "mistake": "🔴", "blunder": "💥"}
-        player = "⚪" if a.white_to_move else "⚫"
-        
-        with st.expander(
-            f"{emoji.get(a.classification, '⚪')} Move {a.move_number}. {a.move} ({player}) • {a.classification.upper()}"
-        ):
-            mcol1, mcol2 = st.columns([1, 2])
-            
-            with mcol1:
-                # Show board after move
-                try:
-                    board_after = chess.Board(a.fen_after)
-                    svg = chess.svg.board(board_after, size=250)
-                    st.markdown(f'<div style="display: flex; justify-content: center;">{svg}</div>', unsafe_allow_html=True)
-                except:
-                    st.write("Board preview unavailable")
-            
-            with mcol2:
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Eval", f"{a.eval_score:.0f} cp")
-                with col2:
-                    st.metric("Risk", f"{a.risk_score:.1f}/100")
-                with col3:
-                    if not a.is_best_move:
-                        st.markdown(f"**Better Move:**")
-                        st.code(a.best_alternative)
-                    else:
-                        st.success("✓ Best move!")
+    move_by_move_panel()
     
     # Player statistics
     st.divider()
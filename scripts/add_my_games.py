@@ -6,23 +6,33 @@ import json
 from pathlib import Path
 
 
-def extract_games_from_pgn(pgn_file: str, max_games: int = 20):
-    """Extract games from PGN file"""
-    games_data = []
+def iter_games_from_pgn(pgn_file: str, max_games: int = 20):
+    """
+    Yield game info dicts from PGN file, one at a time (only one game is held in memory)
     
+    Each game's 'pgn' is its text exactly as in the source file, so comments
+    (e.g. {[%clk ...]} clock times), NAGs and side variations are kept; the
+    app's parser ignores them and analyzes the mainline only.
+    """
     with open(pgn_file) as f:
         game_count = 0
         while game_count < max_games:
-            game = chess.pgn.read_game(f)
-            if game is None:
+            # Only the headers are parsed; the movetext is skipped, and the
+            # game's PGN is read back from the file between the two offsets
+            start = f.tell()
+            headers = chess.pgn.read_headers(f)
+            if headers is None:
                 break
+            end = f.tell()
             
-            # Extract metadata
-            headers = game.headers
-            
-            # Get PGN string
-            exporter = chess.pgn.StringExporter(headers=True, variations=False, comments=False)
-            pgn_string = game.accept(exporter)
+            f.seek(start)
+            lines = []
+            while f.tell() != end:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            pgn_string = "".join(lines).strip()
             
             game_info = {
                 'white': headers.get('White', 'Unknown'),
@@ -35,10 +45,34 @@ def extract_games_from_pgn(pgn_file: str, max_games: int = 20):
                 'pgn': pgn_string
             }
             
-            games_data.append(game_info)
+            yield game_info
             game_count += 1
+
+
+def extract_games_from_pgn(pgn_file: str, max_games: int = 20):
+    """Extract games from PGN file"""
+    return list(iter_games_from_pgn(pgn_file, max_games=max_games))
+
+
+def write_games_json(games, output_file: Path):
+    """
+    Stream games to a JSON array file one record at a time
     
-    return games_data
+    Returns:
+        (number of games written, first game or None)
+    """
+    count = 0
+    first = None
+    with open(output_file, 'w') as f:
+        f.write("[")
+        for game in games:
+            f.write(",\n  " if count else "\n  ")
+            f.write(json.dumps(game, indent=2).replace("\n", "\n  "))
+            if first is None:
+                first = game
+            count += 1
+        f.write("\n]\n" if count else "]\n")
+    return count, first
 
 
 if __name__ == "__main__":
@@ -52,22 +86,19 @@ if __name__ == "__main__":
     pgn_file = sys.argv[1]
     
     print(f"Reading games from: {pgn_file}")
-    games = extract_games_from_pgn(pgn_file, max_games=20)
-    
-    print(f"\nExtracted {len(games)} games")
     
-    # Save to JSON
+    # Save to JSON, writing each game as it is read
     output_file = Path(__file__).parent.parent / "data" / "my_chess_games.json"
     output_file.parent.mkdir(exist_ok=True)
     
-    with open(output_file, 'w') as f:
-        json.dump(games, f, indent=2)
+    count, sample = write_games_json(iter_games_from_pgn(pgn_file, max_games=20), output_file)
     
+    print(f"\nExtracted {count} games")
     print(f"Saved to: {output_file}")
     
     # Print sample
-    if games:
+    if sample:
         print(f"\nSample game:")
-        print(f"  {games[0]['white']} vs {games[0]['black']}")
-        print(f"  Result: {games[0]['result']}")
-        print(f"  Date: {games[0]['date']}")
+        print(f"  {sample['white']} vs {sample['black']}")
+        print(f"  Result: {sample['result']}")
+        print(f"  Date: {sample['date']}")
@@ -1,34 +1,78 @@
 """
 Chess.com API integration
 """
+import re
 import requests
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import List, Dict, Mapping
+import threading
 import time
 
 
+_TAG_RE = re.compile(r'\[(\w+)\s+"([^"]*)"\]')
+
+
+def _fast_tags(pgn: str) -> Dict[str, str]:
+    """Read PGN header tags with a regex (no full PGN parse)"""
+    header_block = pgn.split("\n\n", 1)[0]
+    return dict(_TAG_RE.findall(header_block))
+
+
 class ChessComAPI:
     """Chess.com API wrapper with robust error handling"""
     
     BASE_URL = "https://api.chess.com/pub"
+    MAX_CONCURRENT_DOWNLOADS = 4
+    MIN_REQUEST_INTERVAL = 0.3  # seconds between request starts (~3 req/s)
     
     def __init__(self, username: str):
         self.username = username.lower()
+        self.session = self._make_session()
+        self._throttle_lock = threading.Lock()
+        self._next_request_at = 0.0
+    
+    @staticmethod
+    def _make_session() -> requests.Session:
+        """Pooled session (one TLS handshake reused across calls) with retries on transient errors"""
+        retry = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False  # hand the last response back so status codes are still reported
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip"})
+        return session
+    
+    def _throttle(self):
+        """Space request starts MIN_REQUEST_INTERVAL apart, across threads"""
+        with self._throttle_lock:
+            now = time.monotonic()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self.MIN_REQUEST_INTERVAL
+        if wait > 0:
+            time.sleep(wait)
     
     def get_player_profile(self) -> Dict:
         """Get player profile"""
         try:
             url = f"{self.BASE_URL}/player/{self.username}"
             print(f"Fetching profile: {url}")
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             
-            if response.status_code == 200:
+            if response.ok:
                 data = response.json()
                 print(f"✓ Profile loaded: {data.get('username')}")
                 return data
             else:
                 print(f"✗ Profile error: {response.status_code}")
                 return {}
-        except Exception as e:
+        except requests.RequestException as e:
             print(f"✗ Profile exception: {e}")
             return {}
     
@@ -36,12 +80,12 @@ class ChessComAPI:
         """Get player statistics"""
         try:
             url = f"{self.BASE_URL}/player/{self.username}/stats"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             
-            if response.status_code == 200:
+            if response.ok:
                 return response.json()
             return {}
-        except:
+        except requests.RequestException:
             return {}
     
     def get_archives(self) -> List[str]:
@@ -49,57 +93,81 @@ class ChessComAPI:
         try:
             url = f"{self.BASE_URL}/player/{self.username}/games/archives"
             print(f"Fetching archives: {url}")
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             
-            if response.status_code == 200:
+            if response.ok:
                 archives = response.json().get('archives', [])
                 print(f"✓ Found {len(archives)} archive months")
                 return archives
             else:
                 print(f"✗ Archives error: {response.status_code}")
                 return []
-        except Exception as e:
+        except requests.RequestException as e:
             print(f"✗ Archives exception: {e}")
             return []
     
-    def get_recent_games(self, n_months: int = 2) -> List[Dict]:
-        """Download most recent games"""
+    def get_archive_games(self, archive_url: str) -> List[Dict]:
+        """Download all games from one monthly archive"""
         try:
-            archives = self.get_archives()
-            
-            if not archives:
-                print("✗ No archives found")
-                return []
+            print(f"Fetching games from: {archive_url}")
+            response = self.session.get(archive_url, timeout=15)
             
-            print(f"Latest archive: {archives[-1]}")
-            
-            # Get games from most recent months
-            recent_archives = archives[-n_months:]
-            all_games = []
-            
-            for archive_url in recent_archives:
-                try:
-                    print(f"Fetching games from: {archive_url}")
-                    response = requests.get(archive_url, timeout=15)
-                    
-                    if response.status_code == 200:
-                        games_data = response.json()
-                        games = games_data.get('games', [])
-                        print(f"✓ Got {len(games)} games from this month")
-                        all_games.extend(games)
-                    
-                    time.sleep(0.3)  # Rate limiting
-                    
-                except Exception as e:
-                    print(f"✗ Error fetching archive: {e}")
-                    continue
-            
-            print(f"✓ Total games retrieved: {len(all_games)}")
-            return all_games
-            
-        except Exception as e:
-            print(f"✗ Error in get_recent_games: {e}")
+            if response.ok:
+                games = response.json().get('games', [])
+                print(f"✓ Got {len(games)} games from this month")
+                return games
+            print(f"✗ Archive error: {response.status_code}")
+            return []
+        except requests.RequestException as e:
+            print(f"✗ Error fetching archive: {e}")
+            return []
+    
+    def get_recent_games(self, n_months: int = 2) -> List[Dict]:
+        """Download most recent games"""
+        archives = self.get_archives()
+        
+        if not archives:
+            print("✗ No archives found")
             return []
+        
+        print(f"Latest archive: {archives[-1]}")
+        
+        # Get games from most recent months
+        recent_archives = archives[-n_months:]
+        all_games = []
+        
+        # Download months concurrently, throttled to stay within the rate limit
+        def fetch(archive_url):
+            self._throttle()
+            return self.get_archive_games(archive_url)
+        
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_DOWNLOADS) as executor:
+            for games in executor.map(fetch, recent_archives):
+                all_games.extend(games)
+        
+        print(f"✓ Total games retrieved: {len(all_games)}")
+        return all_games
+    
+    def get_last_n_games(self, n: int = 10) -> List[Dict]:
+        """Download only the n most recent games, newest archive first"""
+        if n <= 0:
+            return []
+        
+        archives = self.get_archives()
+        
+        if not archives:
+            print("✗ No archives found")
+            return []
+        
+        games = []
+        # Walk back month by month only until we have enough games
+        for archive_url in reversed(archives):
+            self._throttle()
+            games = self.get_archive_games(archive_url) + games
+            if len(games) >= n:
+                break
+        
+        return games[-n:]
     
     def format_game_info(self, game: Dict) -> Dict:
         """Format game information"""
@@ -107,11 +175,17 @@ class ChessComAPI:
             white = game.get('white', {})
             black = game.get('black', {})
             
+            # The JSON normally carries players and ratings; only fall back
+            # to the PGN's header tags when one of them is missing
+            tags = {}
+            if not all(k in side for side in (white, black) for k in ('username', 'rating')):
+                tags = _fast_tags(game.get('pgn', ''))
+            
             return {
-                'white': white.get('username', 'Unknown'),
-                'black': black.get('username', 'Unknown'),
-                'white_rating': white.get('rating', '?'),
-                'black_rating': black.get('rating', '?'),
+                'white': white.get('username', tags.get('White', 'Unknown')),
+                'black': black.get('username', tags.get('Black', 'Unknown')),
+                'white_rating': white.get('rating', tags.get('WhiteElo', '?')),
+                'black_rating': black.get('rating', tags.get('BlackElo', '?')),
                 'result': white.get('result', '?'),
                 'time_class': game.get('time_class', 'unknown'),
                 'time_control': game.get('time_control', '?'),
@@ -135,10 +209,9 @@ class ChessComAPI:
             }
 
 
-def get_famous_games() -> Dict[str, str]:
-    """Curated collection of famous chess games"""
-    return {
-        "Kasparov's Immortal": """[Event "Hoogovens A Tournament"]
+# Curated collection of famous chess games, built once at import
+_FAMOUS_GAMES = {
+    "Kasparov's Immortal": """[Event "Hoogovens A Tournament"]
 [Site "Wijk aan Zee NED"]
 [Date "1999.01.20"]
 [White "Garry Kasparov"]
@@ -146,8 +219,8 @@ def get_famous_games() -> Dict[str, str]:
 [Result "1-0"]
 
 1. e4 d6 2. d4 Nf6 3. Nc3 g6 4. Be3 Bg7 5. Qd2 c6 6. f3 b5 7. Nge2 Nbd7 8. Bh6 Bxh6 9. Qxh6 Bb7 10. a3 e5 11. O-O-O Qe7 12. Kb1 a6 13. Nc1 O-O-O 14. Nb3 exd4 15. Rxd4 c5 16. Rd1 Nb6 17. g3 Kb8 18. Na5 Ba8 19. Bh3 d5 20. Qf4+ Ka7 21. Rhe1 d4 22. Nd5 Nbxd5 23. exd5 Qd6 24. Rxd4 cxd4 25. Re7+ Kb6 26. Qxd4+ Kxa5 27. b4+ Ka4 28. Qc3 Qxd5 29. Ra7 Bb7 30. Rxb7 Qc4 31. Qxf6 Kxa3 32. Qxa6+ Kxb4 33. c3+ Kxc3 34. Qa1+ Kd2 35. Qb2+ Kd1 36. Bf1 Rd2 37. Rd7 Rxd7 38. Bxc4 bxc4 39. Qxh8 Rd3 40. Qa8 c3 41. Qa4+ Ke1 42. f4 f5 43. Kc1 Rd2 44. Qa7 1-0""",
-        
-        "Fischer's Game of the Century": """[Event "Third Rosenwald Trophy"]
+    
+    "Fischer's Game of the Century": """[Event "Third Rosenwald Trophy"]
 [Site "New York, NY USA"]
 [Date "1956.10.17"]
 [White "Donald Byrne"]
@@ -155,8 +228,8 @@ def get_famous_games() -> Dict[str, str]:
 [Result "0-1"]
 
 1. Nf3 Nf6 2. c4 g6 3. Nc3 Bg7 4. d4 O-O 5. Bf4 d5 6. Qb3 dxc4 7. Qxc4 c6 8. e4 Nbd7 9. Rd1 Nb6 10. Qc5 Bg4 11. Bg5 Na4 12. Qa3 Nxc3 13. bxc3 Nxe4 14. Bxe7 Qb6 15. Bc4 Nxc3 16. Bc5 Rfe8+ 17. Kf1 Be6 18. Bxb6 Bxc4+ 19. Kg1 Ne2+ 20. Kf1 Nxd4+ 21. Kg1 Ne2+ 22. Kf1 Nc3+ 23. Kg1 axb6 24. Qb4 Ra4 25. Qxb6 Nxd1 26. h3 Rxa2 27. Kh2 Nxf2 28. Re1 Rxe1 29. Qd8+ Bf8 30. Nxe1 Bd5 31. Nf3 Ne4 32. Qb8 b5 33. h4 h5 34. Ne5 Kg7 35. Kg1 Bc5+ 36. Kf1 Ng3+ 37. Ke1 Bb4+ 38. Kd1 Bb3+ 39. Kc1 Ne2+ 40. Kb1 Nc3+ 41. Kc1 Rc2# 0-1""",
-        
-        "The Immortal Game": """[Event "London"]
+    
+    "The Immortal Game": """[Event "London"]
 [Site "London ENG"]
 [Date "1851.06.21"]
 [White "Adolf Anderssen"]
@@ -164,8 +237,8 @@ def get_famous_games() -> Dict[str, str]:
 [Result "1-0"]
 
 1. e4 e5 2. f4 exf4 3. Bc4 Qh4+ 4. Kf1 b5 5. Bxb5 Nf6 6. Nf3 Qh6 7. d3 Nh5 8. Nh4 Qg5 9. Nf5 c6 10. g4 Nf6 11. Rg1 cxb5 12. h4 Qg6 13. h5 Qg5 14. Qf3 Ng8 15. Bxf4 Qf6 16. Nc3 Bc5 17. Nd5 Qxb2 18. Bd6 Bxg1 19. e5 Qxa1+ 20. Ke2 Na6 21. Nxg7+ Kd8 22. Qf6+ Nxf6 23. Be7# 1-0""",
-        
-        "Opera Game": """[Event "Paris Opera"]
+    
+    "Opera Game": """[Event "Paris Opera"]
 [Site "Paris FRA"]
 [Date "1858.??.??"]
 [White "Paul Morphy"]
@@ -173,8 +246,8 @@ def get_famous_games() -> Dict[str, str]:
 [Result "1-0"]
 
 1. e4 e5 2. Nf3 d6 3. d4 Bg4 4. dxe5 Bxf3 5. Qxf3 dxe5 6. Bc4 Nf6 7. Qb3 Qe7 8. Nc3 c6 9. Bg5 b5 10. Nxb5 cxb5 11. Bxb5+ Nbd7 12. O-O-O Rd8 13. Rxd7 Rxd7 14. Rd1 Qe6 15. Bxd7+ Nxd7 16. Qb8+ Nxb8 17. Rd8# 1-0""",
-        
-        "Evergreen Game": """[Event "Berlin"]
+    
+    "Evergreen Game": """[Event "Berlin"]
 [Site "Berlin GER"]
 [Date "1852.??.??"]
 [White "Adolf Anderssen"]
@@ -182,4 +255,10 @@ def get_famous_games() -> Dict[str, str]:
 [Result "1-0"]
 
 1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. b4 Bxb4 5. c3 Ba5 6. d4 exd4 7. O-O d3 8. Qb3 Qf6 9. e5 Qg6 10. Re1 Nge7 11. Ba3 b5 12. Qxb5 Rb8 13. Qa4 Bb6 14. Nbd2 Bb7 15. Ne4 Qf5 16. Bxd3 Qh5 17. Nf6+ gxf6 18. exf6 Rg8 19. Rad1 Qxf3 20. Rxe7+ Nxe7 21. Qxd7+ Kxd7 22. Bf5+ Ke8 23. Bd7+ Kf8 24. Bxe7# 1-0"""
-    }
+}
+_FAMOUS_GAMES_VIEW = MappingProxyType(_FAMOUS_GAMES)
+
+
+def get_famous_games() -> Mapping[str, str]:
+    """Curated collection of famous chess games (read-only, shared)"""
+    return _FAMOUS_GAMES_VIEW
@@ -3,19 +3,29 @@ Fast game analyzer - simplified for speed
 """
 import chess
 import chess.pgn
-from typing import List, Dict
+from typing import List, Dict, Generator, Tuple
+import numpy as np
 import pandas as pd
 from dataclasses import dataclass
+from itertools import islice
 import sys
+import multiprocessing
+import multiprocessing.util
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from tqdm import tqdm
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from src.risk_calculator import RiskCalculator
-from src.game_parser import GameParser
+from src.risk_calculator import RiskCalculator, engine_threads
+from src.stockfish_analyzer import PositionEvaluation, shutdown_engine_pool
+from src.game_parser import GameParser, GamePosition
 
 
-@dataclass
+@dataclass(slots=True)
 class MoveAnalysis:
     """Simple move analysis"""
     move_number: int
@@ -26,16 +36,167 @@ class MoveAnalysis:
     is_best_move: bool
     best_alternative: str
     classification: str
-    fen_after: str  # Added for board display
+    snapshot_after: tuple  # Position after the move, from board_snapshot
+    
+    @property
+    def board_after(self) -> chess.Board:
+        """Position after the move, rebuilt only when asked for"""
+        return board_from_snapshot(self.snapshot_after)
+    
+    @property
+    def fen_after(self) -> str:
+        return self.board_after.fen()
+
+
+def board_snapshot(board: chess.Board) -> tuple:
+    """Compact, picklable tuple of ints describing a position (no move stack)"""
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK],
+            board.turn, board.castling_rights, board.ep_square,
+            board.halfmove_clock, board.fullmove_number)
+
+
+def board_from_snapshot(snapshot: tuple) -> chess.Board:
+    """Inverse of board_snapshot"""
+    (pawns, knights, bishops, rooks, queens, kings, white, black,
+     turn, castling_rights, ep_square, halfmove_clock, fullmove_number) = snapshot
+    board = chess.Board(None)
+    board.pawns, board.knights, board.bishops = pawns, knights, bishops
+    board.rooks, board.queens, board.kings = rooks, queens, kings
+    board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK] = white, black
+    board.occupied = white | black
+    board.turn = turn
+    board.castling_rights = castling_rights
+    board.ep_square = ep_square
+    board.halfmove_clock = halfmove_clock
+    board.fullmove_number = fullmove_number
+    return board
+
+
+# Scalar MoveAnalysis fields exported as DataFrame columns, with their dtypes
+DATAFRAME_COLUMNS = {
+    "move_number": np.int32,
+    "move": object,
+    "white_to_move": bool,
+    "eval_score": np.float32,
+    "risk_score": np.float32,
+    "is_best_move": bool,
+    "best_alternative": object,
+    "classification": object,
+}
+
+
+def analyses_to_dataframe(analyses: List[MoveAnalysis]) -> pd.DataFrame:
+    """Build a DataFrame from move analyses (no engine required)"""
+    return pd.DataFrame({
+        col: np.fromiter((getattr(a, col) for a in analyses), dtype=dtype, count=len(analyses))
+        for col, dtype in DATAFRAME_COLUMNS.items()
+    })
+
+
+# Move classifications, in the order of their int8 codes in AnalysisTable
+CLASSIFICATIONS = ("excellent", "good", "inaccuracy", "mistake", "blunder")
+_CLASSIFICATION_CODES = {name: code for code, name in enumerate(CLASSIFICATIONS)}
+
+
+@dataclass(slots=True)
+class AnalysisTable:
+    """Column-oriented copy of move analyses (one array per field) for aggregation"""
+    move_number: np.ndarray  # int32
+    white_to_move: np.ndarray  # bool
+    classification: np.ndarray  # int8 codes into CLASSIFICATIONS
+    risk_score: np.ndarray  # float16 (0-100 needs no more precision)
+    eval_score: np.ndarray  # int16 centipawns, mate scores clipped to +/-EVAL_CLIP
+    
+    EVAL_CLIP = 30000
+    
+    def __len__(self) -> int:
+        return len(self.move_number)
+    
+    @classmethod
+    def from_analyses(cls, analyses: List[MoveAnalysis]) -> "AnalysisTable":
+        n = len(analyses)
+        return cls(
+            move_number=np.fromiter((a.move_number for a in analyses), dtype=np.int32, count=n),
+            white_to_move=np.fromiter((a.white_to_move for a in analyses), dtype=bool, count=n),
+            classification=np.fromiter(
+                (_CLASSIFICATION_CODES[a.classification] for a in analyses), dtype=np.int8, count=n
+            ),
+            risk_score=np.fromiter((a.risk_score for a in analyses), dtype=np.float16, count=n),
+            eval_score=np.clip(
+                np.rint(np.fromiter((a.eval_score for a in analyses), dtype=np.float64, count=n)),
+                -cls.EVAL_CLIP, cls.EVAL_CLIP
+            ).astype(np.int16),
+        )
+
+
+# Process-local analyzer, created once per worker by _init_worker, and the
+# game its engine last searched
+_worker_analyzer = None
+_worker_game = None
+
+
+def _init_worker(stockfish_path: str, depth: int, threads: int):
+    global _worker_analyzer
+    _worker_analyzer = GameAnalyzer(stockfish_path=stockfish_path, depth=depth, threads=threads)
+    # Pool workers leave with os._exit, skipping atexit, so quit Stockfish
+    # from a multiprocessing finalizer instead
+    multiprocessing.util.Finalize(None, shutdown_engine_pool, exitpriority=10)
+
+
+def _analyze_segment(analyzer: "GameAnalyzer", board: chess.Board,
+                     moves: List[chess.Move]) -> List[MoveAnalysis]:
+    # Consecutive moves on one analyzer let its evaluation cache reuse each
+    # "after" search as the next move's "before"
+    analyses = []
+    for move in moves:
+        try:
+            analyses.append(analyzer.analyze_move(board, move))
+        except Exception as e:
+            print(f"Error on move {move}: {e}")
+        board.push(move)
+    return analyses
+
+
+def _analyze_segment_worker(game: int, board: chess.Board, moves: List[chess.Move]) -> List[MoveAnalysis]:
+    global _worker_game
+    # Like the serial path, clear the engine's hash between games (but not
+    # between two segments of the same game)
+    if game != _worker_game:
+        _worker_analyzer.risk_calc.analyzer.new_game()
+        _worker_game = game
+    return _analyze_segment(_worker_analyzer, board, moves)
 
 
 class GameAnalyzer:
     """Fast, simplified game analyzer"""
     
-    def __init__(self, stockfish_path: str = None, depth: int = 10):
-        """Initialize with lower depth for speed"""
-        self.risk_calc = RiskCalculator(stockfish_path=stockfish_path, depth=depth)
+    def __init__(self, stockfish_path: str = None, depth: int = 10, workers: int = 1,
+                 threads: int = None):
+        """Initialize with lower depth for speed
+        
+        Args:
+            workers: Number of worker processes (each with its own Stockfish)
+                used to analyze moves in parallel; 1 analyzes serially
+            threads: Search threads per Stockfish (see RiskCalculator)
+        """
+        self.risk_calc = RiskCalculator(stockfish_path=stockfish_path, depth=depth, threads=threads)
         self.parser = GameParser()
+        self.stockfish_path = stockfish_path
+        self.depth = depth
+        self.workers = workers
+        self._pool = None
+        self._games = 0  # Games sent to the worker pool, used as the workers' game id
+    
+    def _search(self, board: chess.Board) -> Tuple[PositionEvaluation, list]:
+        """
+        Evaluation and top moves for a position from one MultiPV search
+        
+        The position after move N is the position before move N+1; the
+        analyzer's cache makes the second lookup free, so every position in
+        a game is searched once.
+        """
+        return self.risk_calc.analyzer.analyze_multipv(board, num_moves=3)
     
     def classify_move(self, eval_before: float, eval_after: float, is_best: bool) -> str:
         """Classify move quality"""
@@ -57,17 +218,22 @@ class GameAnalyzer:
         move_san = board.san(move)
         white_to_move = board.turn == chess.WHITE
         
+        # Generate the legal moves once and share them with the risk metrics
+        legal_moves = list(board.legal_moves)
+        
         # Get position metrics
-        metrics_before = self.risk_calc.calculate_risk_metrics(board)
+        eval_before, top_moves = self._search(board)
+        metrics_before = self.risk_calc.calculate_risk_metrics(
+            board, eval_result=eval_before, top_moves=top_moves, legal_moves=legal_moves
+        )
         
-        # Make move and evaluate
-        board.push(move)
-        fen_after = board.fen()  # Capture FEN after move
-        eval_after = -self.risk_calc.analyzer.evaluate_position(board).score
-        board.pop()
+        # Make move on a throwaway copy and evaluate (no push/pop on the caller's board)
+        board_after = board.copy(stack=False)
+        board_after.push(move)
+        eval_after = -self._search(board_after)[0].score
         
         # Check if best move
-        is_best = (move.uci() == metrics_before.best_move)
+        is_best = (move == metrics_before.best_move)
         best_alternative = metrics_before.top_moves[0]['move'] if metrics_before.top_moves else ""
         
         # Classify
@@ -86,7 +252,7 @@ class GameAnalyzer:
             is_best_move=is_best,
             best_alternative=best_alternative,
             classification=classification,
-            fen_after=fen_after
+            snapshot_after=board_snapshot(board_after)
         )
     
     def analyze_game(self, game: chess.pgn.Game, max_moves: int = 50) -> List[MoveAnalysis]:
@@ -94,60 +260,183 @@ class GameAnalyzer:
         if game is None:
             return []
         
-        analyses = []
         board = game.board()
-        moves = list(game.mainline_moves())[:max_moves]
+        moves = list(islice(game.mainline_moves(), max_moves))
+        # Positions of this game share the engine's hash; the last game's don't
+        self.risk_calc.analyzer.new_game()
         
         print(f"Analyzing first {len(moves)} moves...")
         
-        for i, move in enumerate(moves, 1):
-            try:
-                print(f"  Move {i}/{len(moves)}...", end='\r')
-                analysis = self.analyze_move(board, move)
-                analyses.append(analysis)
-                board.push(move)
-            except Exception as e:
-                print(f"Error on move {i}: {e}")
-                continue
+        if self.workers > 1:
+            analyses = self._analyze_parallel(board, moves)
+        else:
+            analyses = []
+            with tqdm(total=len(moves), desc="  Moves", mininterval=0.25, leave=False) as bar:
+                for i, move in enumerate(moves, 1):
+                    bar.update(1)
+                    try:
+                        analysis = self.analyze_move(board, move)
+                        analyses.append(analysis)
+                        board.push(move)
+                    except Exception as e:
+                        print(f"Error on move {i}: {e}")
+                        continue
         
-        print(f"\nDone! Analyzed {len(analyses)} moves")
+        print(f"Done! Analyzed {len(analyses)} moves")
         return analyses
     
+    def _analyze_parallel(self, board: chess.Board, moves: List[chess.Move]) -> List[MoveAnalysis]:
+        """Fan contiguous move segments out to worker processes, each owning its own Stockfish"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),  # never fork the engine's I/O thread
+                initializer=_init_worker,
+                # Split the cores between the workers' engines
+                initargs=(self.stockfish_path, self.depth, engine_threads(self.workers))
+            )
+        
+        if not moves:
+            return []
+        self._games += 1
+        
+        # Pass 1: walk the mainline once, cutting it into one contiguous
+        # segment per worker and snapshotting the board at each segment start
+        size = -(-len(moves) // self.workers)
+        futures = {}
+        for start in range(0, len(moves), size):
+            segment = moves[start:start + size]
+            segment_board = board.copy(stack=False)
+            future = self._pool.submit(_analyze_segment_worker, self._games, segment_board, segment)
+            futures[future] = (start, segment_board, segment)
+            for move in segment:
+                board.push(move)
+        
+        # Pass 2: collect segments as they finish, then stitch them in order.
+        # A segment whose worker failed is analyzed here instead, so a crash
+        # never drops moves from the report
+        results = {}
+        broken = False
+        with tqdm(total=len(moves), desc="  Moves", mininterval=0.25, leave=False) as bar:
+            for future in as_completed(futures):
+                start, segment_board, segment = futures[future]
+                try:
+                    results[start] = future.result()
+                except Exception as e:
+                    print(f"Error on moves from {start + 1}: {e}; analyzing them serially")
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                    results[start] = _analyze_segment(self, segment_board, segment)
+                bar.update(len(segment))
+        
+        if broken:
+            # A dead worker breaks the whole pool; start a fresh one next game
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        
+        return [a for start in sorted(results) for a in results[start]]
+    
     def generate_report(self, analyses: List[MoveAnalysis]) -> Dict:
         """Generate simple report"""
         if not analyses:
             return {}
         
-        white = [a for a in analyses if a.white_to_move]
-        black = [a for a in analyses if not a.white_to_move]
+        table = AnalysisTable.from_analyses(analyses)
         
-        def stats(moves):
-            if not moves:
+        # All per-side statistics in two fused passes: side 0 is white, 1 is black
+        n_classes = len(CLASSIFICATIONS)
+        side = (~table.white_to_move).astype(np.intp)
+        counts = np.bincount(side * n_classes + table.classification, minlength=2 * n_classes)
+        counts = counts.reshape(2, n_classes)
+        # The table's float16 risk is for storage; means are accumulated in
+        # float64 from the exact per-move scores so they match MoveAnalysis
+        risk = np.fromiter((a.risk_score for a in analyses), dtype=np.float64, count=len(analyses))
+        risk_sums = np.bincount(side, weights=risk, minlength=2)
+        
+        def stats(s):
+            total = int(counts[s].sum())
+            if not total:
                 return {}
             return {
-                "total_moves": len(moves),
-                "excellent": sum(1 for m in moves if m.classification == "excellent"),
-                "good": sum(1 for m in moves if m.classification == "good"),
-                "inaccuracies": sum(1 for m in moves if m.classification == "inaccuracy"),
-                "mistakes": sum(1 for m in moves if m.classification == "mistake"),
-                "blunders": sum(1 for m in moves if m.classification == "blunder"),
-                "avg_risk": sum(m.risk_score for m in moves) / len(moves)
+                "total_moves": total,
+                "excellent": int(counts[s, 0]),
+                "good": int(counts[s, 1]),
+                "inaccuracies": int(counts[s, 2]),
+                "mistakes": int(counts[s, 3]),
+                "blunders": int(counts[s, 4]),
+                "avg_risk": float(risk_sums[s]) / total
             }
         
         return {
-            "total_moves": len(analyses),
-            "white": stats(white),
-            "black": stats(black)
+            "total_moves": len(table),
+            "white": stats(0),
+            "black": stats(1)
         }
     
     def analyze_pgn_string(self, pgn_string: str, max_moves: int = 50) -> tuple:
         """Analyze from PGN string"""
-        game = self.parser.parse_pgn_string(pgn_string)
+        game = self.parser.parse_pgn_string(pgn_string, max_moves=max_moves)
         analyses = self.analyze_game(game, max_moves=max_moves)
         report = self.generate_report(analyses)
         return analyses, report
     
+    def evaluate_pgn_file(self, filepath: str,
+                          prefetch: int = 32) -> Generator[Tuple[GamePosition, PositionEvaluation], None, None]:
+        """
+        Evaluate every position of a PGN file while it is still being parsed
+        
+        A background thread parses games and walks their positions into a
+        bounded queue; this thread evaluates them as they arrive, so PGN
+        parsing overlaps with the engine's searches.
+        
+        Args:
+            filepath: Path to PGN file
+            prefetch: Max positions parsed ahead of the engine
+            
+        Yields:
+            (GamePosition, PositionEvaluation) pairs in file order
+        """
+        done = object()
+        positions = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        
+        def put(item):
+            # Give up once the consumer is gone instead of blocking forever
+            while not stop.is_set():
+                try:
+                    positions.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def produce():
+            try:
+                for game_num, game in enumerate(self.parser.parse_pgn_file(filepath), 1):
+                    board = game.board()
+                    for position in self.parser.iter_positions(game, f"game_{game_num}"):
+                        if not put((position, board.copy(stack=False))):
+                            return
+                        board.push(position.mainline[position.move_number - 1])
+            finally:
+                put(done)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            producer = executor.submit(produce)
+            try:
+                while True:
+                    item = positions.get()
+                    if item is done:
+                        break
+                    position, board = item
+                    yield position, self.risk_calc.analyzer.evaluate_position(board)
+            finally:
+                stop.set()
+        producer.result()
+    
     def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
         self.risk_calc.close()
     
     def __enter__(self):
@@ -3,31 +3,77 @@ Parse chess games and extract positions for analysis
 """
 import chess
 import chess.pgn
-from typing import List, Dict, Generator
+from typing import List, Dict, Generator, Tuple, Union
 from dataclasses import dataclass
+from collections import OrderedDict
 import io
+import re
 import sys
 from pathlib import Path
 
 # Add parent to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+_ELO_RE = re.compile(r'\[(White|Black)Elo\s+"([^"]*)"\]')
+_ELO_RE_BYTES = re.compile(rb'\[(White|Black)Elo\s+"([^"]*)"\]')
 
-@dataclass
+
+@dataclass(slots=True)
 class GamePosition:
     """Single position from a game"""
-    fen: str
     move_number: int
     move_played: str
     white_to_move: bool
     game_id: str
+    start_board: chess.Board  # Game's starting position, shared by all its positions
+    mainline: Tuple[chess.Move, ...]  # Game's mainline moves, shared by all its positions
+    
+    @property
+    def board(self) -> chess.Board:
+        """Position before the move, replayed from the start only when asked for"""
+        board = self.start_board.copy(stack=False)
+        for move in self.mainline[:self.move_number - 1]:
+            board.push(move)
+        return board
+    
+    @property
+    def fen(self) -> str:
+        """FEN of the position, formatted only when asked for"""
+        return self.board.fen()
+
+
+class _TruncatedGameBuilder(chess.pgn.GameBuilder):
+    """Builds only the first max_moves mainline moves; later SAN is never parsed"""
+    
+    def __init__(self, max_moves: int):
+        super().__init__()
+        self.max_moves = max_moves
+        self.parsed = 0
+    
+    def begin_variation(self):
+        return chess.pgn.SKIP
+    
+    def end_variation(self):
+        # python-chess calls this when a skipped variation closes, and also at
+        # a ")" after a SAN error switched it to skip mode; begin_variation
+        # never pushes, so only pop a variation that was actually entered
+        if len(self.variation_stack) > 1:
+            super().end_variation()
+    
+    def begin_parse_san(self, board: chess.Board, san: str):
+        if self.parsed >= self.max_moves:
+            return chess.pgn.SKIP
+        self.parsed += 1
 
 
 class GameParser:
     """Parse PGN games and extract positions"""
     
+    # Max parsed games remembered by parse_pgn_string
+    PARSE_CACHE_SIZE = 256
+    
     def __init__(self):
-        pass
+        self._parse_cache = OrderedDict()
     
     def parse_pgn_file(self, filepath: str) -> Generator[chess.pgn.Game, None, None]:
         """
@@ -53,18 +99,59 @@ class GameParser:
             print(f"Error parsing PGN file: {e}")
             return
     
-    def parse_pgn_string(self, pgn_string: str) -> chess.pgn.Game:
-        """Parse single game from PGN string"""
+    def parse_pgn_string(self, pgn_string: str, max_moves: int = None) -> chess.pgn.Game:
+        """
+        Parse single game from PGN string
+        
+        Args:
+            pgn_string: PGN text
+            max_moves: If given, only the first max_moves mainline moves are
+                parsed (variations and later SAN are skipped)
+        """
         try:
             # Clean up the PGN string
             pgn_string = pgn_string.strip()
+            
+            # Re-parsing the same game (e.g. at another depth) replays the
+            # already resolved mainline moves instead of parsing SAN again
+            key = (pgn_string, max_moves)
+            cached = self._parse_cache.get(key)
+            if cached is not None:
+                self._parse_cache.move_to_end(key)
+                return self._rebuild_game(*cached)
+            
             pgn = io.StringIO(pgn_string)
-            game = chess.pgn.read_game(pgn)
+            if max_moves is None:
+                game = chess.pgn.read_game(pgn)
+            else:
+                game = chess.pgn.read_game(pgn, Visitor=lambda: _TruncatedGameBuilder(max_moves))
+            
+            if game is not None and not game.errors:
+                self._parse_cache[key] = (dict(game.headers), tuple(game.mainline_moves()))
+                if len(self._parse_cache) > self.PARSE_CACHE_SIZE:
+                    self._parse_cache.popitem(last=False)
             return game
         except Exception as e:
             print(f"Error parsing PGN string: {e}")
             return None
     
+    @staticmethod
+    def _rebuild_game(headers: Dict[str, str], moves: Tuple[chess.Move, ...]) -> chess.pgn.Game:
+        """Game from cached headers and mainline moves (comments and variations are not kept)"""
+        game = chess.pgn.Game(headers)
+        node = game
+        for move in moves:
+            node = node.add_variation(move)
+        return game
+    
+    def parse_pgn_headers(self, pgn_string: str) -> chess.pgn.Headers:
+        """Parse only the headers of the first game in a PGN string (no SAN parsing)"""
+        try:
+            return chess.pgn.read_headers(io.StringIO(pgn_string.strip()))
+        except Exception as e:
+            print(f"Error parsing PGN headers: {e}")
+            return None
+    
     def extract_positions(self, game: chess.pgn.Game, 
                          game_id: str = "") -> List[GamePosition]:
         """
@@ -77,53 +164,69 @@ class GameParser:
         Returns:
             List of GamePosition objects
         """
+        return list(self.iter_positions(game, game_id))
+    
+    def iter_positions(self, game: chess.pgn.Game,
+                       game_id: str = "") -> Generator[GamePosition, None, None]:
+        """
+        Yield the positions of a game one at a time (see extract_positions)
+        
+        Args:
+            game: chess.pgn.Game object
+            game_id: Identifier for the game
+            
+        Yields:
+            GamePosition objects
+        """
         if game is None:
-            return []
+            return
         
-        positions = []
         board = game.board()
+        # One board walks the game; positions share its start and move list
+        start_board = board.copy(stack=False)
+        mainline = tuple(game.mainline_moves())
         
         try:
-            for move_num, move in enumerate(game.mainline_moves(), 1):
+            for move_num, move in enumerate(mainline, 1):
                 # Store position before move
                 pos = GamePosition(
-                    fen=board.fen(),
                     move_number=move_num,
                     move_played=board.san(move),
                     white_to_move=board.turn == chess.WHITE,
-                    game_id=game_id
+                    game_id=game_id,
+                    start_board=start_board,
+                    mainline=mainline
                 )
-                positions.append(pos)
+                yield pos
                 
                 # Make the move
                 board.push(move)
         except Exception as e:
             print(f"Error extracting positions: {e}")
-        
-        return positions
     
-    def get_game_metadata(self, game: chess.pgn.Game) -> Dict[str, str]:
-        """Extract metadata from game headers"""
+    def get_game_metadata(self, game: Union[chess.pgn.Game, chess.pgn.Headers]) -> Dict[str, str]:
+        """Extract metadata from game headers (accepts a Game or parsed Headers)"""
         if game is None:
             return {}
         
+        headers = getattr(game, "headers", game)
         return {
-            "event": game.headers.get("Event", "Unknown"),
-            "white": game.headers.get("White", "Unknown"),
-            "black": game.headers.get("Black", "Unknown"),
-            "result": game.headers.get("Result", "*"),
-            "date": game.headers.get("Date", "Unknown"),
-            "white_elo": game.headers.get("WhiteElo", "?"),
-            "black_elo": game.headers.get("BlackElo", "?"),
+            "event": headers.get("Event", "Unknown"),
+            "white": headers.get("White", "Unknown"),
+            "black": headers.get("Black", "Unknown"),
+            "result": headers.get("Result", "*"),
+            "date": headers.get("Date", "Unknown"),
+            "white_elo": headers.get("WhiteElo", "?"),
+            "black_elo": headers.get("BlackElo", "?"),
         }
     
-    def filter_by_rating(self, game: chess.pgn.Game, 
+    def filter_by_rating(self, game: Union[chess.pgn.Game, chess.pgn.Headers], 
                         min_rating: int = 1800) -> bool:
         """
         Check if game meets minimum rating threshold
         
         Args:
-            game: chess.pgn.Game object
+            game: chess.pgn.Game object, or Headers from parse_pgn_headers
             min_rating: Minimum Elo rating
             
         Returns:
@@ -132,12 +235,42 @@ class GameParser:
         if game is None:
             return False
         
+        headers = getattr(game, "headers", game)
         try:
-            white_elo = int(game.headers.get("WhiteElo", "0"))
-            black_elo = int(game.headers.get("BlackElo", "0"))
+            white_elo = int(headers.get("WhiteElo", "0"))
+            black_elo = int(headers.get("BlackElo", "0"))
             return white_elo >= min_rating and black_elo >= min_rating
         except (ValueError, TypeError):
             return False
+    
+    def fast_filter_by_rating(self, pgn: Union[str, bytes], min_rating: int = 1800) -> bool:
+        """
+        filter_by_rating straight from raw PGN text, without parsing the game
+        
+        Only the header block (up to the first blank line) is scanned for the
+        WhiteElo/BlackElo tags.
+        
+        Args:
+            pgn: PGN text of one game, as str or bytes
+            min_rating: Minimum Elo rating
+            
+        Returns:
+            True if both players meet threshold
+        """
+        pgn = pgn.lstrip()
+        is_bytes = isinstance(pgn, bytes)
+        end = pgn.find(b"\n\n" if is_bytes else "\n\n")
+        header_block = pgn if end < 0 else pgn[:end]
+        if is_bytes:
+            elos = {side.decode(): value for side, value in _ELO_RE_BYTES.findall(header_block)}
+        else:
+            elos = dict(_ELO_RE.findall(header_block))
+        try:
+            white_elo = int(elos.get("White", "0"))
+            black_elo = int(elos.get("Black", "0"))
+            return white_elo >= min_rating and black_elo >= min_rating
+        except ValueError:
+            return False
 
 
 if __name__ == "__main__":
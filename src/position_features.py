@@ -2,7 +2,8 @@
 Extract features from chess positions for risk analysis
 """
 import chess
-from typing import Dict
+from functools import cached_property
+from typing import Dict, List
 import numpy as np
 import sys
 from pathlib import Path
@@ -10,6 +11,28 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 
+def _pawn_shield_mask(king_square: chess.Square, color: chess.Color) -> chess.Bitboard:
+    """Squares in front of the king (clamped to the board edge) whose pawns shield it"""
+    king_file = chess.square_file(king_square)
+    king_rank = chess.square_rank(king_square)
+    rank = min(king_rank + 1, 7) if color == chess.WHITE else max(king_rank - 1, 0)
+    mask = chess.BB_EMPTY
+    for file in (king_file - 1, king_file, king_file + 1):
+        if 0 <= file <= 7:
+            mask |= chess.BB_SQUARES[chess.square(file, rank)]
+    return mask
+
+
+# King zone (the king's square plus its neighbours) for every square
+KING_ZONE = [chess.BB_KING_ATTACKS[sq] | chess.BB_SQUARES[sq] for sq in chess.SQUARES]
+
+# Pawn shield squares for every king square, per colour
+PAWN_SHIELD = {
+    color: [_pawn_shield_mask(sq, color) for sq in chess.SQUARES]
+    for color in chess.COLORS
+}
+
+
 class PositionFeatures:
     """Calculate position features for risk assessment"""
     
@@ -23,6 +46,12 @@ class PositionFeatures:
         chess.KING: 0
     }
     
+    # Center squares (d4, d5, e4, e5; the squares of chess.BB_CENTER)
+    CENTER_SQUARES = [chess.D4, chess.D5, chess.E4, chess.E5]
+    
+    # (piece_type, value) pairs that count towards material (kings are skipped)
+    MATERIAL_ITEMS = [(pt, val) for pt, val in PIECE_VALUES.items() if val]
+    
     def __init__(self):
         pass
     
@@ -36,14 +65,10 @@ class PositionFeatures:
         white_material = 0
         black_material = 0
         
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                value = self.PIECE_VALUES.get(piece.piece_type, 0)
-                if piece.color == chess.WHITE:
-                    white_material += value
-                else:
-                    black_material += value
+        # Popcount each piece type's bitboard instead of visiting all 64 squares
+        for piece_type, value in self.MATERIAL_ITEMS:
+            white_material += value * chess.popcount(board.pieces_mask(piece_type, chess.WHITE))
+            black_material += value * chess.popcount(board.pieces_mask(piece_type, chess.BLACK))
         
         return {
             "white_material": white_material,
@@ -63,40 +88,17 @@ class PositionFeatures:
         if king_square is None:
             return {"safety_score": 0, "attackers_near_king": 0, "pawn_shield": 0}
         
-        # Count enemy pieces attacking squares around king
-        king_file = chess.square_file(king_square)
-        king_rank = chess.square_rank(king_square)
-        
+        # Count (enemy piece, zone square) attack pairs: one attack mask per
+        # enemy piece ANDed with the precomputed king zone
+        zone = KING_ZONE[king_square]
         attackers_count = 0
-        for file_offset in [-1, 0, 1]:
-            for rank_offset in [-1, 0, 1]:
-                new_file = king_file + file_offset
-                new_rank = king_rank + rank_offset
-                
-                if 0 <= new_file <= 7 and 0 <= new_rank <= 7:
-                    square = chess.square(new_file, new_rank)
-                    attackers_count += len(board.attackers(not color, square))
+        for square in chess.scan_forward(board.occupied_co[not color]):
+            attackers_count += chess.popcount(board.attacks_mask(square) & zone)
         
         # Check pawn shield
-        pawn_shield = 0
-        if color == chess.WHITE:
-            shield_squares = [
-                chess.square(king_file - 1, min(king_rank + 1, 7)) if king_file > 0 else None,
-                chess.square(king_file, min(king_rank + 1, 7)),
-                chess.square(king_file + 1, min(king_rank + 1, 7)) if king_file < 7 else None,
-            ]
-        else:
-            shield_squares = [
-                chess.square(king_file - 1, max(king_rank - 1, 0)) if king_file > 0 else None,
-                chess.square(king_file, max(king_rank - 1, 0)),
-                chess.square(king_file + 1, max(king_rank - 1, 0)) if king_file < 7 else None,
-            ]
-        
-        for sq in shield_squares:
-            if sq is not None:
-                piece = board.piece_at(sq)
-                if piece and piece.piece_type == chess.PAWN and piece.color == color:
-                    pawn_shield += 1
+        pawn_shield = chess.popcount(
+            board.pieces_mask(chess.PAWN, color) & PAWN_SHIELD[color][king_square]
+        )
         
         safety_score = pawn_shield * 10 - attackers_count * 5
         
@@ -106,12 +108,12 @@ class PositionFeatures:
             "pawn_shield": pawn_shield
         }
     
-    def mobility(self, board: chess.Board) -> Dict[str, int]:
+    def mobility(self, board: chess.Board, legal_moves: List[chess.Move] = None) -> Dict[str, int]:
         """
-        Calculate mobility (number of legal moves)
+        Calculate mobility (number of legal moves; legal_moves reused if given)
         """
         # Current player's mobility
-        current_mobility = board.legal_moves.count()
+        current_mobility = board.legal_moves.count() if legal_moves is None else len(legal_moves)
         
         # Opponent's mobility (switch perspective temporarily)
         opponent_mobility = 0
@@ -133,25 +135,16 @@ class PositionFeatures:
         """
         Evaluate control of center squares (d4, d5, e4, e5)
         """
-        center_squares = [chess.D4, chess.D5, chess.E4, chess.E5]
-        
         white_control = 0
         black_control = 0
         
-        for square in center_squares:
-            white_attackers = len(board.attackers(chess.WHITE, square))
-            black_attackers = len(board.attackers(chess.BLACK, square))
-            
-            white_control += white_attackers
-            black_control += black_attackers
-            
-            # Bonus for occupying center
-            piece = board.piece_at(square)
-            if piece:
-                if piece.color == chess.WHITE:
-                    white_control += 2
-                else:
-                    black_control += 2
+        for square in self.CENTER_SQUARES:
+            white_control += chess.popcount(board.attackers_mask(chess.WHITE, square))
+            black_control += chess.popcount(board.attackers_mask(chess.BLACK, square))
+        
+        # Bonus for occupying center, read off the occupancy bitboards
+        white_control += 2 * chess.popcount(board.occupied_co[chess.WHITE] & chess.BB_CENTER)
+        black_control += 2 * chess.popcount(board.occupied_co[chess.BLACK] & chess.BB_CENTER)
         
         return {
             "white_center_control": white_control,
@@ -159,36 +152,45 @@ class PositionFeatures:
             "center_control_advantage": white_control - black_control
         }
     
-    def position_complexity(self, board: chess.Board) -> float:
+    def position_complexity(self, board: chess.Board, material: Dict[str, int] = None,
+                            mobility: Dict[str, int] = None) -> float:
         """
         Estimate position complexity
         Based on: material on board, number of pieces, mobility
+        (material/mobility reused if given)
         """
-        material = self.calculate_material(board)
+        if material is None:
+            material = self.calculate_material(board)
         total_material = material["white_material"] + material["black_material"]
         
-        mobility = self.mobility(board)
+        if mobility is None:
+            mobility = self.mobility(board)
         total_mobility = mobility["current_player_mobility"] + mobility["opponent_mobility"]
         
         # More pieces + more possible moves = more complex
-        piece_count = len(board.piece_map())
+        piece_count = chess.popcount(board.occupied)
         
         # Normalize complexity score to 0-100 range
         complexity = (piece_count * 2 + total_mobility / 10 + total_material / 100) / 3
         
         return min(complexity, 100)
     
-    def extract_all_features(self, board: chess.Board) -> Dict:
+    def extract_all_features(self, board: chess.Board, legal_moves: List[chess.Move] = None) -> Dict:
         """
         Extract all features for a position
         
+        Args:
+            legal_moves: The position's legal moves, if the caller already
+                generated them (saves a move generation for mobility)
+        
         Returns:
             Dict with all position features
         """
         features = {}
         
         # Material
-        features.update(self.calculate_material(board))
+        material = self.calculate_material(board)
+        features.update(material)
         
         # King safety for both sides
         white_king_safety = self.king_safety(board, chess.WHITE)
@@ -199,13 +201,14 @@ class PositionFeatures:
         features["black_pawn_shield"] = black_king_safety["pawn_shield"]
         
         # Mobility
-        features.update(self.mobility(board))
+        mobility = self.mobility(board, legal_moves)
+        features.update(mobility)
         
         # Center control
         features.update(self.center_control(board))
         
         # Complexity
-        features["complexity"] = self.position_complexity(board)
+        features["complexity"] = self.position_complexity(board, material, mobility)
         
         # Game phase
         total_material = features["white_material"] + features["black_material"]
@@ -217,6 +220,78 @@ class PositionFeatures:
             features["game_phase"] = "endgame"
         
         return features
+    
+    def features(self, board: chess.Board, legal_moves: List[chess.Move] = None) -> "FeatureBundle":
+        """Lazy alternative to extract_all_features (features computed on access)"""
+        return FeatureBundle(self, board, legal_moves)
+
+
+class FeatureBundle:
+    """
+    Features of one position, each group computed only on first access
+    
+    Reads like the extract_all_features dict (bundle["complexity"]), but
+    a caller that only needs the complexity never pays for king safety or
+    center control.
+    """
+    
+    # Feature key -> the property computing its group
+    _GROUP_OF = {
+        "white_material": "material", "black_material": "material", "balance": "material",
+        "white_king_safety": "king_features", "black_king_safety": "king_features",
+        "white_pawn_shield": "king_features", "black_pawn_shield": "king_features",
+        "current_player_mobility": "mobility", "opponent_mobility": "mobility",
+        "mobility_advantage": "mobility",
+        "white_center_control": "center_control", "black_center_control": "center_control",
+        "center_control_advantage": "center_control",
+    }
+    
+    def __init__(self, extractor: PositionFeatures, board: chess.Board,
+                 legal_moves: List[chess.Move] = None):
+        self.extractor = extractor
+        self.board = board
+        self.legal_moves = legal_moves
+    
+    @cached_property
+    def material(self) -> Dict[str, int]:
+        return self.extractor.calculate_material(self.board)
+    
+    @cached_property
+    def king_features(self) -> Dict[str, int]:
+        white = self.extractor.king_safety(self.board, chess.WHITE)
+        black = self.extractor.king_safety(self.board, chess.BLACK)
+        return {
+            "white_king_safety": white["safety_score"],
+            "black_king_safety": black["safety_score"],
+            "white_pawn_shield": white["pawn_shield"],
+            "black_pawn_shield": black["pawn_shield"],
+        }
+    
+    @cached_property
+    def mobility(self) -> Dict[str, int]:
+        return self.extractor.mobility(self.board, self.legal_moves)
+    
+    @cached_property
+    def center_control(self) -> Dict[str, int]:
+        return self.extractor.center_control(self.board)
+    
+    @cached_property
+    def complexity(self) -> float:
+        return self.extractor.position_complexity(self.board, self.material, self.mobility)
+    
+    @cached_property
+    def game_phase(self) -> str:
+        total_material = self.material["white_material"] + self.material["black_material"]
+        if self.board.fullmove_number < 10:
+            return "opening"
+        elif total_material > 2500:
+            return "middlegame"
+        return "endgame"
+    
+    def __getitem__(self, key: str):
+        if key in ("complexity", "game_phase"):
+            return getattr(self, key)
+        return getattr(self, self._GROUP_OF[key])[key]
 
 
 if __name__ == "__main__":
@@ -3,14 +3,23 @@ Simplified risk calculation - FAST version for beginners
 """
 import chess
 import numpy as np
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from dataclasses import dataclass
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from src.stockfish_analyzer import StockfishAnalyzer
-from src.position_features import PositionFeatures
+from src.stockfish_analyzer import StockfishAnalyzer, PositionEvaluation
+from src.position_features import PositionFeatures, FeatureBundle
+
+
+def engine_threads(engines: int, max_threads: int = 2) -> int:
+    """Search threads per engine so that `engines` concurrent engines fit the CPU cores"""
+    return max(1, min(max_threads, (os.cpu_count() or 2) // engines))
 
 
 @dataclass
@@ -19,30 +28,48 @@ class RiskMetrics:
     risk_score: float  # 0-100
     position_eval: float  # Centipawns
     complexity: float  # 0-100
-    best_move: str
+    best_move: Optional[chess.Move]
     top_moves: list  # Top 3 moves with scores
 
 
 class RiskCalculator:
     """Fast, simplified risk calculator"""
     
-    def __init__(self, stockfish_path: str = None, depth: int = 12):
-        """Initialize with lower depth for speed"""
-        self.analyzer = StockfishAnalyzer(stockfish_path, depth=depth, threads=2)
+    def __init__(self, stockfish_path: str = None, depth: int = 12, engines: int = 1,
+                 threads: int = None):
+        """Initialize with lower depth for speed
+        
+        Args:
+            engines: Number of Stockfish processes to keep for
+                calculate_risk_metrics_many (each thread checks one out)
+            threads: Search threads per engine; by default 2, fewer when
+                the engines would together oversubscribe the CPU cores
+        """
+        if threads is None:
+            threads = engine_threads(engines)
+        self.analyzer = StockfishAnalyzer(stockfish_path, depth=depth, threads=threads)
         self.feature_extractor = PositionFeatures()
+        self._analyzers = [self.analyzer] + [
+            StockfishAnalyzer(stockfish_path, depth=depth, threads=threads)
+            for _ in range(engines - 1)
+        ]
+        self._pool = queue.Queue()
+        for analyzer in self._analyzers:
+            self._pool.put(analyzer)
     
-    def calculate_risk_score(self, board: chess.Board) -> float:
-        """Simple risk score based on position features"""
-        features = self.feature_extractor.extract_all_features(board)
+    def calculate_risk_score(self, board: chess.Board, legal_moves: List[chess.Move] = None,
+                             features: FeatureBundle = None) -> float:
+        """Simple risk score based on position features (legal_moves/features reused if given)"""
+        if legal_moves is None:
+            legal_moves = list(board.legal_moves)
+        if features is None:
+            features = self.feature_extractor.features(board, legal_moves)
         
         # Simplified risk calculation
         complexity = features["complexity"]
         mobility = features["current_player_mobility"]
         
-        # Count tactical elements
-        legal_moves = list(board.legal_moves)
-        checks = sum(1 for move in legal_moves if board.gives_check(move))
-        captures = sum(1 for move in legal_moves if board.is_capture(move))
+        checks, captures = self.count_checks_and_captures(board, legal_moves)
         
         tactical_density = min((checks * 5 + captures * 2), 50)
         
@@ -51,17 +78,98 @@ class RiskCalculator:
         
         return min(max(risk, 0), 100)
     
-    def calculate_risk_metrics(self, board: chess.Board) -> RiskMetrics:
-        """Calculate all metrics for a position"""
-        # Get evaluation and best moves
-        eval_result = self.analyzer.evaluate_position(board)
-        top_moves = self.analyzer.get_top_moves(board, num_moves=3)
+    def count_checks_and_captures(self, board: chess.Board, legal_moves: List[chess.Move] = None):
+        """
+        Count checking and capturing moves in a single pass over the legal moves
         
-        # Calculate risk
-        risk_score = self.calculate_risk_score(board)
+        Captures are read off the enemy occupancy bitboard. Checks come from
+        bitboards around the enemy king: a move checks directly if it lands on
+        a square from which its piece type attacks the king, or discovers a
+        check if it moves one of our blockers off the line to one of our
+        sliders. Only castling, en passant and promotions are played out with
+        gives_check.
+        """
+        us = board.turn
+        enemy = board.occupied_co[not us]
+        occupied = board.occupied
+        king = board.king(not us)
+        moves = board.legal_moves if legal_moves is None else legal_moves
+        
+        if king is None:
+            checks = sum(board.gives_check(move) for move in moves)
+            captures = sum(board.is_capture(move) for move in moves)
+            return checks, captures
+        
+        # Squares from which each piece type would attack the enemy king
+        diagonal = chess.BB_DIAG_ATTACKS[king][chess.BB_DIAG_MASKS[king] & occupied]
+        straight = (chess.BB_RANK_ATTACKS[king][chess.BB_RANK_MASKS[king] & occupied]
+                    | chess.BB_FILE_ATTACKS[king][chess.BB_FILE_MASKS[king] & occupied])
+        check_squares = {
+            chess.PAWN: chess.BB_PAWN_ATTACKS[not us][king],
+            chess.KNIGHT: chess.BB_KNIGHT_ATTACKS[king],
+            chess.BISHOP: diagonal,
+            chess.ROOK: straight,
+            chess.QUEEN: diagonal | straight,
+            chess.KING: chess.BB_EMPTY,
+        }
+        
+        # Our pieces that are the only piece between the enemy king and one of our sliders
+        ours = board.occupied_co[us]
+        queens = board.queens & ours
+        snipers = ((chess.BB_RANK_ATTACKS[king][0] | chess.BB_FILE_ATTACKS[king][0])
+                   & ((board.rooks & ours) | queens))
+        snipers |= chess.BB_DIAG_ATTACKS[king][0] & ((board.bishops & ours) | queens)
+        blockers = chess.BB_EMPTY
+        for sniper in chess.scan_reversed(snipers):
+            between = chess.between(king, sniper) & occupied
+            if between and not between & (between - 1) and between & ours:
+                blockers |= between
+        
+        checks = captures = 0
+        for move in moves:
+            to_bb = chess.BB_SQUARES[move.to_square]
+            if to_bb & enemy:
+                captures += 1
+            elif move.to_square == board.ep_square and board.is_en_passant(move):
+                captures += 1
+                checks += board.gives_check(move)
+                continue
+            
+            if move.promotion or board.is_castling(move):
+                checks += board.gives_check(move)
+                continue
+            
+            from_bb = chess.BB_SQUARES[move.from_square]
+            if to_bb & check_squares[board.piece_type_at(move.from_square)]:
+                checks += 1
+            elif from_bb & blockers and not to_bb & chess.ray(king, move.from_square):
+                checks += 1
         
-        # Get complexity
-        features = self.feature_extractor.extract_all_features(board)
+        return checks, captures
+    
+    def calculate_risk_metrics(self, board: chess.Board, analyzer: StockfishAnalyzer = None,
+                               eval_result: PositionEvaluation = None,
+                               top_moves: list = None,
+                               legal_moves: List[chess.Move] = None) -> RiskMetrics:
+        """Calculate all metrics for a position (reusing eval_result/top_moves/legal_moves if given)"""
+        analyzer = analyzer or self.analyzer
+        
+        # Get evaluation and best moves (one MultiPV search covers both)
+        if eval_result is None and top_moves is None:
+            eval_result, top_moves = analyzer.analyze_multipv(board, num_moves=3)
+        elif eval_result is None:
+            eval_result = analyzer.evaluate_position(board)
+        elif top_moves is None:
+            top_moves = analyzer.get_top_moves(board, num_moves=3)
+        
+        # Generate legal moves once and share one lazy feature bundle between
+        # the risk score and the complexity (only the features read are computed)
+        if legal_moves is None:
+            legal_moves = list(board.legal_moves)
+        features = self.feature_extractor.features(board, legal_moves)
+        
+        # Calculate risk
+        risk_score = self.calculate_risk_score(board, legal_moves, features)
         
         return RiskMetrics(
             risk_score=risk_score,
@@ -71,9 +179,28 @@ class RiskCalculator:
             top_moves=top_moves
         )
     
+    def calculate_risk_metrics_many(self, boards: List[chess.Board]) -> List[RiskMetrics]:
+        """Calculate metrics for several positions, spread across the engine pool"""
+        def run(board):
+            analyzer = self._pool.get()
+            try:
+                return self.calculate_risk_metrics(board, analyzer)
+            finally:
+                self._pool.put(analyzer)
+        
+        # Each distinct position is searched once, whichever engine it lands on
+        unique = {}
+        for board in boards:
+            unique.setdefault(board._transposition_key(), board)
+        
+        with ThreadPoolExecutor(max_workers=len(self._analyzers)) as executor:
+            metrics = dict(zip(unique, executor.map(run, unique.values())))
+        return [metrics[board._transposition_key()] for board in boards]
+    
     def close(self):
         """Clean up"""
-        self.analyzer.close()
+        for analyzer in self._analyzers:
+            analyzer.close()
     
     def __enter__(self):
         return self
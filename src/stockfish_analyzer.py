@@ -1,17 +1,24 @@
 """
 Stockfish integration for position evaluation - FIXED FOR STREAMLIT CLOUD
 """
+import atexit
+import functools
 import chess
 import chess.engine
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
 import shutil
 import sys
+import threading
 
 
+@functools.lru_cache(maxsize=1)
 def get_stockfish_path():
-    """Get Stockfish path - works on Streamlit Cloud and local"""
+    """Get Stockfish path - works on Streamlit Cloud and local (probed once per process)"""
     
     # STREAMLIT CLOUD PATHS - Check these first
     streamlit_paths = [
@@ -55,92 +62,391 @@ def get_stockfish_path():
     )
 
 
+# Idle Stockfish processes kept for reuse, keyed by binary path, so a new
+# analyzer does not pay the engine startup. Each idle engine keeps its hash
+# table (StockfishAnalyzer.HASH_MB, 128 MB by default) allocated for the
+# life of the process, so only a few are kept; raise this to trade memory
+# for fewer engine restarts.
+ENGINE_POOL_SIZE = 2
+_ENGINE_POOL: Dict[str, queue.Queue] = {}
+_ENGINE_POOL_LOCK = threading.Lock()
+# Every engine started and not yet quit, idle or checked out by an analyzer
+_SPAWNED_ENGINES = set()
+
+
+def _engine_queue(stockfish_path: str) -> queue.Queue:
+    with _ENGINE_POOL_LOCK:
+        return _ENGINE_POOL.setdefault(stockfish_path, queue.Queue())
+
+
+def _popen_engine(stockfish_path: str) -> chess.engine.SimpleEngine:
+    """
+    Start an engine whose I/O thread is a daemon thread
+    
+    python-chess runs each engine's event loop on a thread that inherits
+    its daemon flag from the thread that starts it. Started from a
+    short-lived daemon thread, the loop never blocks interpreter exit, and
+    shutdown_engine_pool (a plain atexit hook) can still quit the engine.
+    """
+    started = {}
+    
+    def start():
+        try:
+            started["engine"] = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+        except BaseException as e:
+            started["error"] = e
+    
+    starter = threading.Thread(target=start, name="Stockfish starter", daemon=True)
+    starter.start()
+    starter.join()
+    if "error" in started:
+        raise started["error"]
+    return started["engine"]
+
+
+def _acquire_engine(stockfish_path: str) -> chess.engine.SimpleEngine:
+    """Take an idle engine from the pool, or start a new one"""
+    idle = _engine_queue(stockfish_path)
+    while True:
+        try:
+            engine = idle.get_nowait()
+        except queue.Empty:
+            engine = _popen_engine(stockfish_path)
+            with _ENGINE_POOL_LOCK:
+                _SPAWNED_ENGINES.add(engine)
+            return engine
+        if not engine.protocol.returncode.done():
+            return engine
+        with _ENGINE_POOL_LOCK:
+            _SPAWNED_ENGINES.discard(engine)
+
+
+def _release_engine(stockfish_path: str, engine: chess.engine.SimpleEngine):
+    """Return an engine to the pool (quit it if the pool is full)"""
+    idle = _engine_queue(stockfish_path)
+    if idle.qsize() < ENGINE_POOL_SIZE:
+        idle.put(engine)
+    else:
+        with _ENGINE_POOL_LOCK:
+            _SPAWNED_ENGINES.discard(engine)
+        engine.quit()
+
+
+def shutdown_engine_pool():
+    """Quit every engine started here, idle or still held by an analyzer"""
+    with _ENGINE_POOL_LOCK:
+        engines = list(_SPAWNED_ENGINES)
+        _SPAWNED_ENGINES.clear()
+        for idle in _ENGINE_POOL.values():
+            while True:
+                try:
+                    idle.get_nowait()
+                except queue.Empty:
+                    break
+    for engine in engines:
+        try:
+            engine.quit()
+        except Exception:
+            pass
+
+
+# Engine I/O threads are daemons (see _popen_engine), so they are still
+# running when atexit handlers are called and can quit their engines
+atexit.register(shutdown_engine_pool)
+
+
 @dataclass
 class PositionEvaluation:
     """Container for position evaluation data"""
     score: float
     mate_in: Optional[int]
-    best_move: str
+    best_move: Optional[chess.Move]  # None if the engine returned no PV
     depth: int
 
 
 class StockfishAnalyzer:
     """Wrapper for Stockfish engine analysis"""
     
-    def __init__(self, stockfish_path: str = None, depth: int = 15, threads: int = 2):
-        """Initialize Stockfish engine"""
+    # Max search results kept in the analysis cache
+    CACHE_SIZE = 4096
+    
+    # Transposition table size (MB); analyses walk consecutive positions of
+    # one game, so a larger table keeps more of the previous searches
+    HASH_MB = 128
+    
+    # Centipawn value of a mate; mate in N moves scores +/-(MATE_SCORE - N)
+    MATE_SCORE = 10000
+    
+    def __init__(self, stockfish_path: str = None, depth: int = 15, threads: int = 2,
+                 hash_mb: int = None):
+        """Initialize Stockfish engine
+        
+        Args:
+            hash_mb: Transposition table size in MB (default HASH_MB)
+        """
         if stockfish_path is None:
             stockfish_path = get_stockfish_path()
         
-        self.engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+        self.stockfish_path = stockfish_path
+        self.engine = _acquire_engine(stockfish_path)
         self.depth = depth
         self.threads = threads
-        self.engine.configure({"Threads": threads})
+        self.hash_mb = hash_mb or self.HASH_MB
+        # All options in one go, Hash after Threads; MultiPV is managed by
+        # python-chess per analyse call and cannot be pinned here
+        self.engine.configure({"Threads": threads, "Hash": self.hash_mb})
+        # Searches share this game id, so the engine only receives
+        # ucinewgame (clearing its hash) when new_game() replaces it
+        self._game = object()
+        self._cache = OrderedDict()
+        # One analyzer (and its engine) may be shared across threads, e.g.
+        # by app sessions; searches and cache updates go through this lock
+        self._lock = threading.RLock()
+    
+    def new_game(self):
+        """Start a new game: the next search clears the engine's hash table"""
+        with self._lock:
+            self._game = object()
+    
+    def _cache_get(self, key):
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+        return cached
+    
+    def _cache_put(self, key, value):
+        self._cache[key] = value
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
     
     def evaluate_position(self, board: chess.Board) -> PositionEvaluation:
         """Evaluate a chess position"""
-        info = self.engine.analyse(board, chess.engine.Limit(depth=self.depth))
+        return self.batch_evaluate([board])[0]
+    
+    def batch_evaluate(self, boards: List[chess.Board], depth: int = None) -> List[PositionEvaluation]:
+        """
+        Evaluate several positions over the same UCI session
         
-        score_value = info["score"].relative.score()
-        mate_score = info["score"].relative.mate()
+        All positions are sent as one "game", so the engine never receives
+        ucinewgame between them and keeps its hash table warm (until
+        new_game()). Positions already searched at this depth come from the
+        analysis cache.
+        """
+        depth = depth or self.depth
+        limit = chess.engine.Limit(depth=depth)
+        keys = [(board._transposition_key(), depth, None) for board in boards]
+        with self._lock:
+            evaluations = [self._cache_get(key) for key in keys]
+            
+            misses = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+            if misses:
+                infos = self._analyse_batch([boards[i] for i in misses], limit)
+                for i, info in zip(misses, infos):
+                    evaluations[i] = self._to_evaluation(info, depth)
+                    self._cache_put(keys[i], evaluations[i])
+        return evaluations
+    
+    def _analyse_batch(self, boards: List[chess.Board], limit: chess.engine.Limit) -> List[Dict]:
+        """Search several positions one after another on this analyzer's engine"""
+        return [self.engine.analyse(board, limit, game=self._game) for board in boards]
+    
+    def _to_evaluation(self, info: Dict, depth: int) -> PositionEvaluation:
+        """Convert engine info to a PositionEvaluation"""
+        score = info["score"].relative
         best_move = info.get("pv", [None])[0]
         
-        if mate_score is not None:
-            score = 10000 if mate_score > 0 else -10000
-        else:
-            score = score_value if score_value is not None else 0
-        
         return PositionEvaluation(
-            score=score,
-            mate_in=mate_score,
-            best_move=str(best_move) if best_move else "",
-            depth=self.depth
+            score=score.score(mate_score=self.MATE_SCORE),
+            mate_in=score.mate(),
+            best_move=best_move,
+            depth=depth
         )
     
     def analyze_move(self, board: chess.Board, move: chess.Move) -> Dict[str, float]:
-        """Analyze quality of a specific move"""
+        """
+        Analyze quality of a specific move
+        
+        One full-depth search of the position before the move gives the
+        score and the best move. Playing the best move keeps that score, so
+        it needs no second search; any other move is scored from the cache
+        if its position was already searched, else by a search 2 plies
+        shallower (blunder detection does not hinge on the last plies).
+        """
         eval_before = self.evaluate_position(board)
-        board.push(move)
-        eval_after = self.evaluate_position(board)
-        board.pop()
+        is_best = move == eval_before.best_move
         
-        score_change = eval_before.score - (-eval_after.score)
+        if is_best:
+            eval_after = eval_before.score
+        else:
+            board_after = board.copy(stack=False)
+            board_after.push(move)
+            with self._lock:
+                cached = self._cache_get((board_after._transposition_key(), self.depth, None))
+            if cached is None:
+                cached = self.batch_evaluate([board_after], depth=max(1, self.depth - 2))[0]
+            eval_after = -cached.score
+        
+        score_change = eval_before.score - eval_after
         
         return {
             "eval_before": eval_before.score,
-            "eval_after": -eval_after.score,
+            "eval_after": eval_after,
             "score_change": score_change,
-            "is_best": str(move) == eval_before.best_move
+            "is_best": is_best
         }
     
+    def analyze_moves_bulk(self, boards: List[chess.Board], moves: List[chess.Move]) -> List[Dict[str, float]]:
+        """
+        analyze_move for consecutive moves of a game, on boards the caller already has
+        
+        Args:
+            boards: Position before each move, followed by the final
+                position (len(moves) + 1 boards); nothing is pushed or popped
+            moves: Move played from each position
+            
+        Returns:
+            One analyze_move result dict per move
+        """
+        if len(boards) != len(moves) + 1:
+            raise ValueError("analyze_moves_bulk needs one more board than moves")
+        
+        # Each position is the "after" of one move and the "before" of the
+        # next, so one batch searches every position once at full depth
+        evaluations = self.batch_evaluate(boards)
+        
+        results = []
+        for move, eval_before, eval_after in zip(moves, evaluations, evaluations[1:]):
+            results.append({
+                "eval_before": eval_before.score,
+                "eval_after": -eval_after.score,
+                "score_change": eval_before.score + eval_after.score,
+                "is_best": move == eval_before.best_move
+            })
+        return results
+    
     def get_top_moves(self, board: chess.Board, num_moves: int = 3) -> List[Dict]:
         """Get top N moves with evaluations"""
         try:
+            return self.analyze_multipv(board, num_moves)[1]
+        except:
+            return []
+    
+    def analyze_multipv(self, board: chess.Board, num_moves: int = 3) -> Tuple[PositionEvaluation, List[Dict]]:
+        """
+        Evaluation and top N moves from a single MultiPV search
+        
+        The first PV line is the engine's evaluation and best move, so one
+        search replaces evaluate_position + get_top_moves, and it also fills
+        the cache entry evaluate_position reads. Results are cached by
+        python-chess's transposition key (no FEN formatting), depth and
+        number of lines, as a bounded LRU.
+        """
+        position_key = board._transposition_key()
+        key = (position_key, self.depth, num_moves)
+        with self._lock:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+            
             info = self.engine.analyse(
                 board, 
                 chess.engine.Limit(depth=self.depth),
-                multipv=num_moves
+                multipv=num_moves,
+                game=self._game
             )
-        except:
-            return []
-        
-        results = []
-        for pv_info in info:
-            score = pv_info["score"].relative.score()
-            if score is None:
-                score = 0
             
-            results.append({
-                "move": str(pv_info["pv"][0]),
-                "score": score,
-                "pv": [str(m) for m in pv_info["pv"][:5]]
-            })
+            results = []
+            for pv_info in info:
+                if not pv_info.get("pv"):
+                    continue
+                
+                results.append({
+                    "move": str(pv_info["pv"][0]),
+                    "score": pv_info["score"].relative.score(mate_score=self.MATE_SCORE),
+                    "pv": [str(m) for m in pv_info["pv"][:5]]
+                })
+            
+            evaluation = self._to_evaluation(info[0], self.depth)
+            self._cache_put(key, (evaluation, results))
+            self._cache_put((position_key, self.depth, None), evaluation)
+            return evaluation, results
+    
+    def close(self):
+        """Hand the engine back to the pool for the next analyzer"""
+        with self._lock:
+            if self.engine is not None:
+                _release_engine(self.stockfish_path, self.engine)
+                self.engine = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StockfishPool:
+    """Several single-threaded analyzers that evaluate batches of positions in parallel"""
+    
+    def __init__(self, stockfish_path: str = None, depth: int = 15, size: int = None,
+                 threads: int = 1):
+        """Start the engines
         
-        return results
+        Args:
+            size: Number of engines (default: one per `threads` CPU cores)
+            threads: Search threads per engine; Stockfish scales sublinearly
+                with threads, so many single-threaded engines give the best
+                throughput on independent positions
+        """
+        if size is None:
+            size = max(1, (os.cpu_count() or 2) // threads)
+        self.analyzers = [
+            StockfishAnalyzer(stockfish_path, depth=depth, threads=threads)
+            for _ in range(size)
+        ]
+        self._free = queue.Queue()
+        for analyzer in self.analyzers:
+            self._free.put(analyzer)
+    
+    def __len__(self) -> int:
+        return len(self.analyzers)
+    
+    def evaluate_positions(self, boards: List[chess.Board], depth: int = None) -> List[PositionEvaluation]:
+        """
+        Evaluate positions across all engines, in the order given
+        
+        Each distinct position is searched once. The positions are cut into
+        one contiguous shard per engine, so consecutive positions of a game
+        share an engine's hash table; each shard checks out a free engine.
+        """
+        unique = {}
+        for board in boards:
+            unique.setdefault(board._transposition_key(), board)
+        keys, positions = list(unique), list(unique.values())
+        
+        def run(shard):
+            analyzer = self._free.get()
+            try:
+                return analyzer.batch_evaluate(shard, depth)
+            finally:
+                self._free.put(analyzer)
+        
+        size = -(-len(positions) // len(self.analyzers)) or 1
+        shards = [positions[start:start + size] for start in range(0, len(positions), size)]
+        with ThreadPoolExecutor(max_workers=len(self.analyzers)) as executor:
+            evaluations = [e for shard in executor.map(run, shards) for e in shard]
+        
+        by_key = dict(zip(keys, evaluations))
+        return [by_key[board._transposition_key()] for board in boards]
+    
+    def new_game(self):
+        """Clear every engine's hash table before the next search"""
+        for analyzer in self.analyzers:
+            analyzer.new_game()
     
     def close(self):
-        """Clean up engine"""
-        self.engine.quit()
+        for analyzer in self.analyzers:
+            analyzer.close()
     
     def __enter__(self):
         return self
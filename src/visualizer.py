@@ -1,52 +1,151 @@
 """
 Visualization utilities for risk analysis
 """
+import matplotlib
+matplotlib.use("Agg")  # Headless raster backend; figures are only saved or sent to Streamlit
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
+from dataclasses import dataclass
 import chess
 import chess.svg
+import functools
+import io
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+# Move quality buckets of the quality plot; a best move is "Best" whatever its classification
+QUALITY_CATEGORIES = ('Best', 'Good', 'Inaccuracy', 'Mistake', 'Blunder')
+_QUALITY_CODES = {"excellent": 1, "good": 1, "inaccuracy": 2, "mistake": 3, "blunder": 4}
+
+
+def _to_arrays(analyses: List) -> Dict[str, np.ndarray]:
+    """Read the plotted MoveAnalysis fields into NumPy arrays in one pass"""
+    n = len(analyses)
+    arrays = {
+        "move": np.empty(n, dtype=np.int32),
+        "risk": np.empty(n, dtype=np.float64),
+        "eval": np.empty(n, dtype=np.float64),
+        "white": np.empty(n, dtype=bool),
+        "quality": np.empty(n, dtype=np.int8),  # Index into QUALITY_CATEGORIES
+    }
+    move, risk, evals = arrays["move"], arrays["risk"], arrays["eval"]
+    white, quality = arrays["white"], arrays["quality"]
+    for i, a in enumerate(analyses):
+        move[i] = a.move_number
+        risk[i] = a.risk_score
+        evals[i] = a.eval_score
+        white[i] = a.white_to_move
+        quality[i] = 0 if a.is_best_move else _QUALITY_CODES[a.classification]
+    
+    arrays["blunder"] = quality == 4
+    return arrays
+
+
+@dataclass(slots=True)
+class GameStats:
+    """Move quality counts of one side"""
+    counts: np.ndarray  # Moves per QUALITY_CATEGORIES bucket
+    
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+    
+    @property
+    def accuracy(self) -> float:
+        """Share of best moves, in percent"""
+        return self.counts[0] / self.total * 100 if self.total else 0
+    
+    @classmethod
+    def per_side(cls, arrays: Dict[str, np.ndarray]) -> Tuple["GameStats", "GameStats"]:
+        """White and black stats from one bincount over (side, quality)"""
+        n = len(QUALITY_CATEGORIES)
+        side = (~arrays["white"]).astype(np.intp)
+        counts = np.bincount(side * n + arrays["quality"], minlength=2 * n).reshape(2, n)
+        return cls(counts[0]), cls(counts[1])
+
+
+@functools.lru_cache(maxsize=512)
+def _render_board_svg(fen: str, highlight: tuple) -> str:
+    """Render a position to SVG (memoized: repeat views are a dict lookup)"""
+    fill = {square: '#ff000060' for square in highlight}
+    return chess.svg.board(chess.Board(fen), fill=fill, size=400)
+
 
 class RiskVisualizer:
     """Create visualizations for risk analysis"""
     
-    def __init__(self):
-        sns.set_style("whitegrid")
-        plt.rcParams['figure.figsize'] = (12, 6)
+    # On-screen resolution; charts are shown ~800px wide, so default 100 dpi is wasted rasterization
+    FIGURE_DPI = 72
+    
+    # save_path resolution for web previews; pass dpi=300 for a print export
+    SAVE_DPI = 150
+    
+    _style_applied = False
+    
+    def __init__(self, allow_fig_reuse: bool = True):
+        """
+        Args:
+            allow_fig_reuse: Honour reuse_fig in the plot methods; when False
+                every plot gets a new figure (safe for a shared instance)
+        """
+        # Global matplotlib/seaborn style only needs to be set once per process
+        if not RiskVisualizer._style_applied:
+            sns.set_style("whitegrid")
+            plt.rcParams['figure.figsize'] = (12, 6)
+            RiskVisualizer._style_applied = True
+        # Figures kept by plot method for reuse_fig=True
+        self.allow_fig_reuse = allow_fig_reuse
+        self._fig_cache: Dict[str, plt.Figure] = {}
     
-    def plot_risk_over_time(self, analyses: List, save_path: str = None) -> plt.Figure:
+    def _subplots(self, key: str, reuse_fig: bool, ncols: int = 1, figsize=None):
+        """
+        New figure and axes, or with reuse_fig the cached figure for `key` cleared and refilled
+        
+        Reusing skips creating a Figure (and its pyplot manager) on every
+        replot, but the returned figure is the same object each time: an
+        earlier figure or saved reference is redrawn in place. Do not reuse
+        from a visualizer shared between concurrent callers.
+        """
+        reuse_fig = reuse_fig and self.allow_fig_reuse
+        fig = self._fig_cache.get(key) if reuse_fig else None
+        if fig is None:
+            fig, axes = plt.subplots(1, ncols, figsize=figsize, dpi=self.FIGURE_DPI)
+            if reuse_fig:
+                self._fig_cache[key] = fig
+            return fig, axes
+        # clear() also drops twin axes and colorbars added by the last plot
+        fig.clear()
+        return fig, fig.subplots(1, ncols)
+    
+    def plot_risk_over_time(self, analyses: List, save_path: str = None,
+                            dpi: int = SAVE_DPI, reuse_fig: bool = False) -> plt.Figure:
         """Plot risk score evolution throughout the game"""
-        fig, ax = plt.subplots(figsize=(14, 6))
+        fig, ax = self._subplots('plot_risk_over_time', reuse_fig, figsize=(14, 6))
         
         if not analyses:
             ax.text(0.5, 0.5, 'No data available', ha='center', va='center', transform=ax.transAxes)
             return fig
         
-        white_moves = [(a.move_number, a.risk_score) for a in analyses if a.white_to_move]
-        black_moves = [(a.move_number, a.risk_score) for a in analyses if not a.white_to_move]
+        arrays = _to_arrays(analyses)
+        move, risk, white = arrays["move"], arrays["risk"], arrays["white"]
+        black = ~white
         
-        if white_moves:
-            white_x, white_y = zip(*white_moves)
-            ax.plot(white_x, white_y, 'o-', color='#3498db', 
+        if white.any():
+            ax.plot(move[white], risk[white], 'o-', color='#3498db', 
                    label='White', linewidth=2.5, markersize=7, alpha=0.8)
         
-        if black_moves:
-            black_x, black_y = zip(*black_moves)
-            ax.plot(black_x, black_y, 's-', color='#34495e', 
+        if black.any():
+            ax.plot(move[black], risk[black], 's-', color='#34495e', 
                    label='Black', linewidth=2.5, markersize=7, alpha=0.8)
         
         # Mark blunders
-        blunders = [(a.move_number, a.risk_score) for a in analyses if a.was_blunder]
-        if blunders:
-            blunder_x, blunder_y = zip(*blunders)
-            ax.scatter(blunder_x, blunder_y, color='#e74c3c', s=250, 
+        blunders = arrays["blunder"]
+        if blunders.any():
+            ax.scatter(move[blunders], risk[blunders], color='#e74c3c', s=250, 
                       marker='X', zorder=5, label='Blunder', alpha=0.9, edgecolors='darkred', linewidth=2)
         
         ax.set_xlabel('Move Number', fontsize=13, fontweight='bold')
@@ -67,24 +166,26 @@ class RiskVisualizer:
         ax.text(0.02, 80, 'High Risk', transform=ax.get_yaxis_transform(), 
                fontsize=9, color='red', fontweight='bold', alpha=0.7)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+            fig.savefig(save_path, dpi=dpi)
         
         return fig
     
-    def plot_eval_and_risk(self, analyses: List, save_path: str = None) -> plt.Figure:
+    def plot_eval_and_risk(self, analyses: List, save_path: str = None,
+                           dpi: int = SAVE_DPI, reuse_fig: bool = False) -> plt.Figure:
         """Plot evaluation and risk on dual axes"""
-        fig, ax1 = plt.subplots(figsize=(14, 7))
+        fig, ax1 = self._subplots('plot_eval_and_risk', reuse_fig, figsize=(14, 7))
         
         if not analyses:
             ax1.text(0.5, 0.5, 'No data available', ha='center', va='center', transform=ax1.transAxes)
             return fig
         
-        move_numbers = [a.move_number for a in analyses]
-        evals = [min(max(a.eval_after, -500), 500) for a in analyses]  # Cap at ±500
-        risks = [a.risk_score for a in analyses]
+        arrays = _to_arrays(analyses)
+        move_numbers = arrays["move"]
+        evals = np.clip(arrays["eval"], -500, 500)  # Cap at ±500
+        risks = arrays["risk"]
         
         # Plot evaluation
         color = '#3498db'
@@ -106,50 +207,39 @@ class RiskVisualizer:
         ax2.set_ylim(0, 100)
         
         # Mark critical moments
-        blunders = [a.move_number for a in analyses if a.was_blunder]
-        for move_num in blunders:
+        for move_num in move_numbers[arrays["blunder"]]:
             ax1.axvline(x=move_num, color='red', alpha=0.2, linewidth=3, zorder=0)
         
-        plt.title('Evaluation vs Risk Throughout Game', fontsize=15, fontweight='bold', pad=20)
+        ax2.set_title('Evaluation vs Risk Throughout Game', fontsize=15, fontweight='bold', pad=20)
         
         # Combine legends
         lines1, labels1 = ax1.get_legend_handles_labels()
         lines2, labels2 = ax2.get_legend_handles_labels()
         ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper left', fontsize=11)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+            fig.savefig(save_path, dpi=dpi)
         
         return fig
     
-    def plot_move_quality_distribution(self, analyses: List, save_path: str = None) -> plt.Figure:
+    def plot_move_quality_distribution(self, analyses: List, save_path: str = None,
+                                       dpi: int = SAVE_DPI, reuse_fig: bool = False) -> plt.Figure:
         """Plot distribution of move qualities for each player"""
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
+        fig, (ax1, ax2) = self._subplots('plot_move_quality_distribution', reuse_fig, ncols=2, figsize=(15, 6))
         
-        white_analyses = [a for a in analyses if a.white_to_move]
-        black_analyses = [a for a in analyses if not a.white_to_move]
+        white_stats, black_stats = GameStats.per_side(_to_arrays(analyses))
         
-        def plot_player_quality(ax, player_analyses, player_name):
-            if not player_analyses:
+        def plot_player_quality(ax, stats, player_name):
+            if not stats.total:
                 ax.text(0.5, 0.5, 'No data', ha='center', va='center', transform=ax.transAxes, fontsize=14)
                 ax.set_title(f'{player_name} Move Quality', fontweight='bold', fontsize=13)
                 return
             
-            categories = ['Best', 'Good', 'Inaccuracy', 'Mistake', 'Blunder']
-            
-            best = sum(a.is_best_move for a in player_analyses)
-            good = len(player_analyses) - best - sum(a.was_inaccuracy or a.was_mistake or a.was_blunder 
-                                                     for a in player_analyses)
-            inaccuracies = sum(a.was_inaccuracy for a in player_analyses)
-            mistakes = sum(a.was_mistake for a in player_analyses)
-            blunders = sum(a.was_blunder for a in player_analyses)
-            
-            counts = [best, good, inaccuracies, mistakes, blunders]
             colors_list = ['#27ae60', '#3498db', '#f39c12', '#e67e22', '#e74c3c']
             
-            bars = ax.bar(categories, counts, color=colors_list, alpha=0.85, edgecolor='black', linewidth=1.2)
+            bars = ax.bar(QUALITY_CATEGORIES, stats.counts, color=colors_list, alpha=0.85, edgecolor='black', linewidth=1.2)
             ax.set_ylabel('Number of Moves', fontweight='bold', fontsize=12)
             ax.set_title(f'{player_name} Move Quality', fontweight='bold', fontsize=13)
             ax.grid(axis='y', alpha=0.3)
@@ -163,92 +253,121 @@ class RiskVisualizer:
                            ha='center', va='bottom', fontweight='bold', fontsize=11)
             
             # Calculate accuracy
-            accuracy = (best / len(player_analyses) * 100) if player_analyses else 0
+            accuracy = stats.accuracy
             ax.text(0.5, 0.97, f'Accuracy: {accuracy:.1f}%',
                    transform=ax.transAxes, ha='center', va='top',
                    bbox=dict(boxstyle='round,pad=0.5', facecolor='#f8f9fa', alpha=0.9, edgecolor='gray'),
                    fontweight='bold', fontsize=12)
         
-        plot_player_quality(ax1, white_analyses, '⚪ White')
-        plot_player_quality(ax2, black_analyses, '⚫ Black')
+        plot_player_quality(ax1, white_stats, '⚪ White')
+        plot_player_quality(ax2, black_stats, '⚫ Black')
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+            fig.savefig(save_path, dpi=dpi)
         
         return fig
     
-    def plot_risk_heatmap_by_phase(self, analyses: List, save_path: str = None) -> plt.Figure:
+    def plot_risk_heatmap_by_phase(self, analyses: List, save_path: str = None,
+                                   dpi: int = SAVE_DPI, reuse_fig: bool = False) -> plt.Figure:
         """Create heatmap of risk by game phase"""
-        fig, ax = plt.subplots(figsize=(12, 6))
+        fig, ax = self._subplots('plot_risk_heatmap_by_phase', reuse_fig, figsize=(12, 6))
         
         if not analyses:
             ax.text(0.5, 0.5, 'No data available', ha='center', va='center', transform=ax.transAxes)
             return fig
         
         # Divide game into phases
+        arrays = _to_arrays(analyses)
+        risk, white = arrays["risk"], arrays["white"]
         total_moves = len(analyses)
-        opening = analyses[:min(10, total_moves)]
-        middlegame = analyses[10:max(10, total_moves-10)] if total_moves > 20 else []
-        endgame = analyses[max(10, total_moves-10):] if total_moves > 10 else []
-        
-        phases = []
-        for phase_name, phase_analyses in [('Opening', opening), 
-                                           ('Middlegame', middlegame), 
-                                           ('Endgame', endgame)]:
-            if not phase_analyses:
+        opening = slice(0, min(10, total_moves))
+        middlegame = slice(10, max(10, total_moves-10) if total_moves > 20 else 10)
+        endgame = slice(max(10, total_moves-10) if total_moves > 10 else total_moves, total_moves)
+        
+        phase_names, columns = [], []
+        for phase_name, phase in [('Opening', opening), 
+                                  ('Middlegame', middlegame), 
+                                  ('Endgame', endgame)]:
+            phase_risk, phase_white = risk[phase], white[phase]
+            if not len(phase_risk):
                 continue
             
-            white = [a.risk_score for a in phase_analyses if a.white_to_move]
-            black = [a.risk_score for a in phase_analyses if not a.white_to_move]
+            white_risk = phase_risk[phase_white]
+            black_risk = phase_risk[~phase_white]
             
-            phases.append({
-                'Phase': phase_name,
-                'White Avg': np.mean(white) if white else 0,
-                'Black Avg': np.mean(black) if black else 0,
-            })
+            phase_names.append(phase_name)
+            columns.append((white_risk.mean() if len(white_risk) else 0,
+                            black_risk.mean() if len(black_risk) else 0))
         
-        if not phases:
+        if not phase_names:
             ax.text(0.5, 0.5, 'Insufficient data', ha='center', va='center', transform=ax.transAxes)
             return fig
         
-        df = pd.DataFrame(phases)
-        df_plot = df.set_index('Phase')[['White Avg', 'Black Avg']]
-        
-        sns.heatmap(df_plot.T, annot=True, fmt='.1f', cmap='RdYlGn_r', 
-                   cbar_kws={'label': 'Risk Score'}, ax=ax,
-                   vmin=0, vmax=100, linewidths=2, linecolor='white',
-                   annot_kws={'fontsize': 12, 'fontweight': 'bold'})
-        
+        # Rows are White/Black, columns the phases present
+        data = np.array(columns).T
+        im = ax.imshow(data, cmap='RdYlGn_r', aspect='auto', vmin=0, vmax=100)
+        fig.colorbar(im, ax=ax, label='Risk Score')
+        for i, j in np.ndindex(data.shape):
+            ax.text(j, i, f'{data[i, j]:.1f}', ha='center', va='center',
+                   fontsize=12, fontweight='bold')
+        
+        ax.set_xticks(range(len(phase_names)))
+        ax.set_xticklabels(phase_names)
+        ax.set_yticks([0, 1])
+        ax.set_yticklabels(['White Avg', 'Black Avg'])
+        ax.grid(False)
         ax.set_title('Average Risk by Game Phase', fontweight='bold', fontsize=14, pad=15)
         ax.set_xlabel('')
         ax.set_ylabel('', fontsize=12)
         ax.tick_params(labelsize=11)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+            fig.savefig(save_path, dpi=dpi)
         
         return fig
     
-    def create_board_svg(self, fen: str, highlight_squares: List[int] = None) -> str:
-        """Create SVG representation of board position"""
+    @staticmethod
+    def figure_to_png(fig: plt.Figure, dpi: int = FIGURE_DPI) -> bytes:
+        """Rasterize a figure to PNG bytes and free it
+        
+        PNG bytes are cheap to cache (e.g. with st.cache_data) and display
+        with st.image, so a figure only has to be built once per analysis.
+        """
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=dpi)
+        plt.close(fig)
+        return buf.getvalue()
+    
+    def create_board_svg(self, position: Union[str, chess.Board], highlight_squares: List[int] = None) -> str:
+        """Create SVG representation of board position (FEN or Board)"""
         try:
-            board = chess.Board(fen)
-            
-            fill = {}
-            if highlight_squares:
-                for square in highlight_squares:
-                    fill[square] = '#ff000060'
-            
-            svg = chess.svg.board(board, fill=fill, size=400)
-            return svg
+            fen = position.fen() if isinstance(position, chess.Board) else position
+            return _render_board_svg(fen, tuple(highlight_squares or ()))
         except Exception as e:
             print(f"Error creating board SVG: {e}")
             return ""
 
 
+_visualizer = None
+
+
+def get_visualizer() -> RiskVisualizer:
+    """
+    Shared RiskVisualizer instance
+    
+    Figure reuse is disabled on it (reuse_fig is ignored), so concurrent
+    callers always get their own figures; create a RiskVisualizer of your
+    own to reuse figures across replots.
+    """
+    global _visualizer
+    if _visualizer is None:
+        _visualizer = RiskVisualizer(allow_fig_reuse=False)
+    return _visualizer
+
+
 if __name__ == "__main__":
     print("Visualizer module loaded successfully")
\ No newline at end of file
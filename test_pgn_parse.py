@@ -24,14 +24,15 @@ if game is None:
 else:
     print("✓ Parsed successfully!")
     
-    moves = list(game.mainline_moves())
+    # One walk of the mainline gives the positions and (shared by all of them) the moves
+    positions = list(parser.iter_positions(game, "test_1"))
+    moves = positions[0].mainline if positions else ()
     print(f"✓ Found {len(moves)} moves")
     
     if moves:
         print("✓ Moves:", [str(m) for m in moves])
         
         # Get positions
-        positions = parser.extract_positions(game, "test_1")
         print(f"✓ Extracted {len(positions)} positions")
         
         for pos in positions[:3]:
@@ -0,0 +1,49 @@
+"""
+Round-trip tests for board_snapshot / board_from_snapshot
+"""
+import unittest
+import sys
+from pathlib import Path
+
+import chess
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.game_analyzer import board_snapshot, board_from_snapshot
+
+
+FENS = [
+    chess.STARTING_FEN,
+    # Castling rights on one side only, moves played
+    "r3k2r/pppq1ppp/2np1n2/2b1p3/2B1P3/2NP1N2/PPPQ1PPP/R3K2R w Kq - 4 9",
+    # Legal en passant capture
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    # Black to move, no castling, high move counters
+    "8/5k2/8/3K4/8/8/6P1/8 b - - 37 71",
+    # Promotion pending, side to move in check
+    "4k3/1P6/8/8/8/8/8/4K2r w - - 0 50",
+]
+
+
+class TestBoardSnapshot(unittest.TestCase):
+
+    def test_round_trip_fen(self):
+        for fen in FENS:
+            with self.subTest(fen=fen):
+                board = chess.Board(fen)
+                self.assertEqual(board_from_snapshot(board_snapshot(board)).fen(), board.fen())
+
+    def test_round_trip_game(self):
+        board = chess.Board()
+        for san in ["e4", "d5", "exd5", "c6", "dxc6", "Nxc6", "Nf3", "e5", "Bb5", "Qd6", "O-O"]:
+            board.push_san(san)
+            self.assertEqual(board_from_snapshot(board_snapshot(board)).fen(), board.fen())
+
+    def test_snapshot_is_plain_and_hashable(self):
+        snapshot = board_snapshot(chess.Board())
+        self.assertIsInstance(snapshot, tuple)
+        self.assertEqual(hash(snapshot), hash(board_snapshot(chess.Board())))
+
+
+if __name__ == "__main__":
+    unittest.main()